@@ -5,18 +5,39 @@
 # Imports
 
 import discord
+import aiohttp
+import abc
 import asyncio
+import atexit
+import bisect
+import collections
+import contextlib
+import contextvars
+import difflib
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import logging
+import logging.handlers
 import os
 import datetime
 import random
-import string
 import json
+import queue
+import shutil
+import sqlite3
 import sys
+import tempfile
+import threading
 import time
+import traceback
 
+from aiohttp import web
 from discord import Option
-from discord.ext import commands
+from discord.ext import commands, tasks
 
 VERSION = "1.2.0"
 VERSION_DATE = "February 12th, 2025"
@@ -39,20 +60,6 @@ AFK_FILE = os.path.join(AFK_FOLDER, "afk_data.json")
 # Ensure AFK directory exists
 os.makedirs(AFK_FOLDER, exist_ok=True)
 
-# Initialize AFK data
-if not os.path.exists(AFK_FILE):
-    with open(AFK_FILE, "w") as f:
-        json.dump({}, f)
-
-afk_users = {}
-
-# Load AFK data from JSON file
-try:
-    with open(AFK_FILE, "r") as f:
-        afk_users = json.load(f)
-except FileNotFoundError:
-    afk_users = {}
-
 # ======================================================================================================================================================================================
 # Config Imports
 
@@ -90,29 +97,360 @@ except KeyError:
 text_log_channel = None
 image_log_channel = None
 
+class PhantomBot(commands.Bot):
+    async def login(self, token: str):
+        await super().login(token)
+        watch_rate_limits(self.http._HTTPClient__session)
+
+    async def close(self):
+        # Send and save everything still waiting in memory before disconnecting
+        if transcript_tasks:
+            await asyncio.wait(transcript_tasks, timeout=30)
+        await log_sink.flush()
+        await image_archiver.stop()
+        await modmail_relay.stop()
+        await metrics.stop()
+        await flush_stores()
+        await super().close()
+
+
 # Create a bot instance with a command prefix
-bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
+bot = PhantomBot(command_prefix="!", intents=discord.Intents.all())
 bot.remove_command("help")
 
 # ======================================================================================================================================================================================
 # Staff checks for commands
 
-def is_staff(member: discord.Member, has_mod: bool, has_admin: bool, has_servicer: bool) -> bool:
-    # Check if the member has admin permissions
-    if has_servicer and any(role.id in SERVICER_ROLE_ID for role in member.roles):
-        return True
+# Staff levels are bits, so a member's level is worked out once and then checked with a single "&"
+STAFF_MOD = 1
+STAFF_ADMIN = 2
+STAFF_SERVICER = 4
+STAFF_ADMINISTRATOR = 8  # Has Discord's "Administrator" permission
 
-    if member.guild_permissions.administrator:
-        return True
+# What commands require, having any one of the bits is enough
+MOD_LEVEL = STAFF_MOD | STAFF_ADMIN | STAFF_SERVICER | STAFF_ADMINISTRATOR
+ADMIN_LEVEL = STAFF_ADMIN | STAFF_SERVICER | STAFF_ADMINISTRATOR
 
-    # If the command requires admin and the member does not have it, return False
-    if has_admin and any(role.id in ADMIN_ROLE_ID for role in member.roles):
-        return True
 
-    if has_mod and any(role.id in MOD_ROLE_ID for role in member.roles):
-        return True
+class StaffResolver:
+    """
+    Works out each member's staff level from their roles and caches it. The cache is cleared
+    for a member when their roles change, and for everyone when a role is edited or deleted.
+    """
+
+    def __init__(self, mod_roles: list[int], admin_roles: list[int], servicer_roles: list[int]):
+        self.mod_roles = frozenset(mod_roles)
+        self.admin_roles = frozenset(admin_roles)
+        self.servicer_roles = frozenset(servicer_roles)
+        self.levels = {}  # (guild ID, member ID) -> staff level
+
+    def level(self, member: discord.Member) -> int:
+        key = (member.guild.id, member.id)
+        level = self.levels.get(key)
+        if level is not None:
+            return level
 
-    return False
+        level = STAFF_ADMINISTRATOR if member.guild_permissions.administrator else 0
+        for role in member.roles:
+            if role.id in self.mod_roles:
+                level |= STAFF_MOD
+            if role.id in self.admin_roles:
+                level |= STAFF_ADMIN
+            if role.id in self.servicer_roles:
+                level |= STAFF_SERVICER
+
+        self.levels[key] = level
+        return level
+
+    def forget(self, member: discord.Member):
+        self.levels.pop((member.guild.id, member.id), None)
+
+    def clear(self):
+        self.levels.clear()
+
+
+staff_resolver = StaffResolver(MOD_ROLE_ID, ADMIN_ROLE_ID, SERVICER_ROLE_ID)
+
+
+def has_staff_level(member: discord.Member, required: int) -> bool:
+    return bool(staff_resolver.level(member) & required)
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles != after.roles:
+        staff_resolver.forget(after)
+
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    # Permissions (like "Administrator") can change for everyone with the role
+    staff_resolver.clear()
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    staff_resolver.clear()
+
+# ======================================================================================================================================================================================
+# Background tasks
+# Work started without waiting for it is kept in a set until it's done, so it can't be garbage
+# collected halfway through, and anything it raises gets logged instead of disappearing.
+
+background_tasks = set()
+
+
+def run_in_background(coroutine, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coroutine, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(finish_background_task)
+    return task
+
+
+def finish_background_task(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task '{task.get_name()}' failed: {task.exception()!r}")
+
+
+# ======================================================================================================================================================================================
+# Rate limiting
+# One limiter for commands, buttons and events alike. It uses the generic cell rate algorithm (GCRA):
+# each key only stores the time its bucket is next empty, and keys that have gone idle are evicted.
+
+rate_limiters = []
+
+
+class RateLimiter:
+    """Allows "rate" uses per "per" seconds for each key (a user, channel, guild, or anything else)."""
+
+    def __init__(self, rate: int, per: float, burst: int = 1):
+        self.interval = per / rate
+        self.tolerance = self.interval * (burst - 1)
+        self.buckets = {}  # key -> when the key's bucket is next empty
+        rate_limiters.append(self)
+
+    def hit(self, key) -> float:
+        # Uses up one slot for "key". Returns 0 if allowed, or how many seconds to wait
+        now = time.monotonic()
+        empty_at = max(self.buckets.get(key, now), now)
+        if empty_at - now > self.tolerance:
+            return empty_at - now - self.tolerance
+
+        self.buckets[key] = empty_at + self.interval
+        return 0.0
+
+    def evict(self):
+        # A key whose bucket is empty again is the same as one we've never seen
+        now = time.monotonic()
+        for key in [key for key, empty_at in self.buckets.items() if empty_at <= now]:
+            del self.buckets[key]
+
+
+# Commands (per user unless noted)
+help_limiter = RateLimiter(1, 60)
+slap_limiter = RateLimiter(1, 15)
+topic_limiter = RateLimiter(1, 15)
+member_limiter = RateLimiter(1, 10)
+activity_limiter = RateLimiter(1, 600)  # Per server, it pings a whole role
+version_limiter = RateLimiter(1, 10)
+ping_limiter = RateLimiter(1, 10)
+
+# Buttons and events
+modmail_button_limiter = RateLimiter(1, 5)  # Per ticket channel
+contact_limiter = RateLimiter(1, 30)  # Per user, creating modmail tickets
+dm_reply_limiter = RateLimiter(3, 60, burst=3)  # Per user, "help" and unknown DM replies
+modmail_relay_limiter = RateLimiter(10, 60, burst=10)  # Per user, DMs relayed into their open ticket
+afk_notice_limiter = RateLimiter(1, 30)  # Per channel and AFK user
+
+
+async def on_cooldown(ctx: discord.ApplicationContext, limiter: RateLimiter, key) -> bool:
+    retry_after = limiter.hit(key)
+    if not retry_after:
+        return False
+
+    embed = discord.Embed(
+        title="⏳ Cooldown!",
+        description=f"> This command is on cooldown! Try again in `{retry_after:.2f}` seconds.",
+        color=colors["red"]
+    )
+    embed.set_footer(text="This message was written by server staff.")
+    await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
+    logger.info(f"{ctx.author} tried '{ctx.command.name}' in {ctx.channel}, but it's on cooldown.")
+    return True
+
+
+@tasks.loop(minutes=5)
+async def rate_limit_eviction_loop():
+    for limiter in rate_limiters:
+        limiter.evict()
+
+# ======================================================================================================================================================================================
+# Outbound request priorities
+# Every REST request the bot makes waits for one of a limited number of slots, and slots go to the most
+# important waiting request first. That way /ban and /mute don't queue up behind log embeds when chat is
+# busy. Interaction responses don't go through here at all, they always go out right away.
+# A request keeps its slot while the library waits out a rate limit, so notices and logs may only hold
+# some of the slots. The rest stay free for moderation and modmail even when log traffic is rate limited.
+
+PRIORITY_INTERACTION = 0
+PRIORITY_MODERATION = 1  # Commands and anything not marked otherwise
+PRIORITY_MODMAIL = 2
+PRIORITY_NOTICE = 3  # Welcomes and AFK notices, these wait but are never dropped
+PRIORITY_LOG = 4  # Log embeds and image reuploads, these are put off or dropped under pressure
+
+OUTBOUND_CONCURRENCY = config.get("OUTBOUND_CONCURRENCY", 8)  # REST requests in flight at once
+OUTBOUND_SHED_QUEUE = config.get("OUTBOUND_SHED_QUEUE", 50)  # Waiting requests before log traffic is put off
+OUTBOUND_LOW_PRIORITY_SLOTS = config.get("OUTBOUND_LOW_PRIORITY_SLOTS", max(1, OUTBOUND_CONCURRENCY // 2))  # Slots notices and logs may hold at once
+
+# Set this at the start of a handler or task, every request made from it gets that priority
+outbound_priority = contextvars.ContextVar("outbound_priority", default=PRIORITY_MODERATION)
+
+# The rate limit bucket of the request being sent, so a 429 response can be put on the right bucket
+outbound_bucket = contextvars.ContextVar("outbound_bucket", default=None)
+
+
+class OutboundShed(discord.DiscordException):
+    """Raised instead of sending log traffic while the bot is busy or rate limited."""
+
+
+class OutboundDispatcher:
+    """Hands out request slots by priority and keeps track of the 429s Discord sends back."""
+
+    def __init__(self, concurrency: int, shed_queue: int, low_priority_slots: int):
+        self.available = concurrency
+        self.shed_queue = shed_queue
+        self.low_priority_slots = low_priority_slots
+        self.low_priority_held = 0
+        self.waiters = []  # Heap of (priority, order, future)
+        self.order = itertools.count()
+        self.blocked_until = {}  # Rate limit bucket -> when its 429 is over
+        self.global_blocked_until = 0.0
+        self.rate_limits = 0
+        self.shed = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int, bucket: str):
+        if priority == PRIORITY_INTERACTION:
+            yield
+            return
+
+        # Don't send into a bucket we know is rate limited
+        delay = max(self.blocked_until.get(bucket, 0.0), self.global_blocked_until) - time.monotonic()
+        if priority >= PRIORITY_LOG and (delay > 0 or len(self.waiters) >= self.shed_queue):
+            self.shed += 1
+            raise OutboundShed(f"put off low priority request to {bucket}")
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    async def acquire(self, priority: int):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        self.hand_out()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # If the slot was handed over just as we got cancelled, pass it on
+            if future.done() and not future.cancelled():
+                self.release(priority)
+            raise
+
+    def release(self, priority: int):
+        if priority >= PRIORITY_NOTICE:
+            self.low_priority_held -= 1
+        self.available += 1
+        self.hand_out()
+
+    def hand_out(self):
+        # Give free slots to the most important waiters, skipping any that gave up
+        while self.available and self.waiters:
+            priority, _, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+
+            # Everyone still waiting is a notice or log once the first one is, so they all wait for one of those to finish
+            if priority >= PRIORITY_NOTICE and self.low_priority_held >= self.low_priority_slots:
+                return
+
+            heapq.heappop(self.waiters)
+            self.available -= 1
+            if priority >= PRIORITY_NOTICE:
+                self.low_priority_held += 1
+            future.set_result(None)
+
+    def rate_limited(self, bucket: str | None, retry_after: float):
+        self.rate_limits += 1
+        until = time.monotonic() + retry_after
+        if bucket is None:
+            self.global_blocked_until = until
+        else:
+            self.blocked_until[bucket] = until
+
+        # Forget buckets whose limit has passed
+        now = time.monotonic()
+        for expired in [key for key, blocked in self.blocked_until.items() if blocked <= now]:
+            del self.blocked_until[expired]
+
+
+outbound = OutboundDispatcher(OUTBOUND_CONCURRENCY, OUTBOUND_SHED_QUEUE, OUTBOUND_LOW_PRIORITY_SLOTS)
+
+
+async def on_rest_response(session, context, params: aiohttp.TraceRequestEndParams):
+    # The library retries 429s itself, this only tells the dispatcher about them
+    response = params.response
+    bucket = outbound_bucket.get()
+    if bucket is None:
+        # Sent without the dispatcher, so prioritized_request didn't count it. The URL can hold webhook tokens, so no route.
+        metrics.rest_requests[(params.method, "other")] += 1
+    if response.status != 429:
+        return
+
+    retry_after = float(response.headers.get("X-RateLimit-Reset-After") or response.headers.get("Retry-After") or 1)
+    if response.headers.get("X-RateLimit-Global", "").lower() == "true":
+        outbound.rate_limited(None, retry_after)
+        return
+
+    # Webhooks, interaction responses and CDN downloads share the session but not the dispatcher, so they have no bucket
+    if bucket is not None:
+        outbound.rate_limited(bucket, retry_after)
+    else:
+        outbound.rate_limits += 1  # Still counted, there's just nothing to hold back
+
+
+def watch_rate_limits(session: aiohttp.ClientSession):
+    # The library creates its session when logging in, so the trace is added to it afterwards
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(on_rest_response)
+    trace.freeze()
+    session._trace_configs.append(trace)
+
+
+send_request = bot.http.request
+
+
+async def prioritized_request(route, **kwargs):
+    priority = outbound_priority.get()
+    if route.path.startswith("/interactions/"):
+        priority = PRIORITY_INTERACTION
+
+    bucket = getattr(route, "bucket", route.path)
+    async with outbound.slot(priority, bucket):
+        metrics.rest_requests[(route.method, route.path)] += 1  # Only once it has a slot, shed requests are never sent
+        token = outbound_bucket.set(bucket)
+        try:
+            return await send_request(route, **kwargs)
+        finally:
+            outbound_bucket.reset(token)
+
+
+bot.http.request = prioritized_request
 
 # ======================================================================================================================================================================================
 # When Bot starts
@@ -122,6 +460,26 @@ async def on_ready():
     global text_log_channel, image_log_channel
 
     print(f"Bot is logged in as {bot.user}")
+
+    # on_ready can fire again after a reconnect, so only start the loop once
+    if not flush_loop.is_running():
+        flush_loop.start()
+    if not rate_limit_eviction_loop.is_running():
+        rate_limit_eviction_loop.start()
+    log_sink.start()
+    image_archiver.start()
+    modmail_relay.start()
+    loop_monitor.start()
+    await metrics.start()
+    welcome_batcher.start()
+    raid_detector.start()
+    if not image_eviction_loop.is_running():
+        image_eviction_loop.start()
+    if not filter_reload_loop.is_running():
+        filter_reload_loop.start()
+    arm_timers()
+    prepare_modmail()
+
     activity = discord.Activity(type=STATUS_TYPE, name=STATUS_TEXT)
     await bot.change_presence(activity=activity)
 
@@ -129,7 +487,7 @@ async def on_ready():
         text_log_channel = bot.get_channel(TEXT_LOG_CHANNEL_ID)
     else:
         logger.warning("Text Log Channel not configured (That's Okay 👍)")
-    if image_log_channel is not None:
+    if IMAGE_LOG_CHANNEL_ID is not None:
         image_log_channel = bot.get_channel(IMAGE_LOG_CHANNEL_ID)
     else:
         logger.warning("Image Log Channel not configured (That's Okay 👍)")
@@ -148,6 +506,12 @@ class ModmailView(discord.ui.View):
 
     @discord.ui.button(label="Resolved", style=discord.ButtonStyle.success)
     async def resolved_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        outbound_priority.set(PRIORITY_MODMAIL)
+
+        retry_after = modmail_button_limiter.hit(interaction.channel.id)
+        if retry_after:
+            await interaction.response.send_message(f"⏳ Slow down! Try again in `{retry_after:.2f}` seconds.", ephemeral=True)
+            return
 
         # Update permissions to restrict access to staff only
         overwrites = {
@@ -163,19 +527,10 @@ class ModmailView(discord.ui.View):
             text="This message was written by server staff.",
         )
 
-        # Load modmail logs
-        modmail_logs = load_modmail_logs()
-        user_id = None
+        # Mark the ticket as resolved
         channel = interaction.channel
+        modmail_store.set_status(channel.id, "resolved")
 
-        for uid, data in modmail_logs.items():
-            if data["channel_id"] == channel.id:
-                user_id = uid
-                break
-
-        if user_id:
-            modmail_logs[user_id]["status"] = "resolved"
-            save_modmail_logs(modmail_logs)
         for allowed_roles in self.allowed_roles:
             for role_id in allowed_roles:
                 role = self.guild.get_role(role_id)
@@ -186,117 +541,2045 @@ class ModmailView(discord.ui.View):
                     return
         await interaction.response.send_message(embed=embed)
 
-        # Add "(R)" to the resolved channel name
-        new_name = f"(R) {channel.name}"
-        logger.info(f"ticket '{channel.name}' has been resolved.")
-        await channel.edit(name=new_name)
-        await channel.edit(overwrites=overwrites)
+        # Add "(R)" to the resolved channel name
+        new_name = f"(R) {channel.name}"
+        logger.info(f"ticket '{channel.name}' has been resolved.")
+        await channel.edit(name=new_name)
+        await channel.edit(overwrites=overwrites)
+
+    # ======================================================================================================================================================================================
+    # The buttons for the ModMail Interactions
+    # Part One: "Closed"
+
+    @discord.ui.button(label="Close", style=discord.ButtonStyle.danger)
+    async def close_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        outbound_priority.set(PRIORITY_MODMAIL)
+
+        # Check if the user has permission to use this button
+        if not has_staff_level(interaction.user, MOD_LEVEL):
+            await interaction.response.send_message("You don't have permission to close this thread.", ephemeral=True)
+            return
+
+        retry_after = modmail_button_limiter.hit(interaction.channel.id)
+        if retry_after:
+            await interaction.response.send_message(f"⏳ Slow down! Try again in `{retry_after:.2f}` seconds.", ephemeral=True)
+            return
+
+        embed = discord.Embed(
+            title="🚫 Channel Deletion",
+            description="> This channel will be deleted in a few seconds, once the transcript is saved.",
+            color=colors["red"]
+        )
+        embed.set_footer(
+            text="This message was written by server staff.",
+        )
+
+        # Mark the ticket as resolved
+        channel = interaction.channel
+        modmail_store.set_status(channel.id, "resolved")
+
+        await interaction.response.send_message(embed=embed)
+
+        # Wait for 5 seconds
+        await asyncio.sleep(5)
+
+        channel = interaction.channel
+        timer_store.cancel("modmail_close", channel.id)
+        logger.info(f"ticket '{interaction.channel}' has been closed.")
+        start_ticket_close(channel, "Modmail thread closed.")
+
+
+# ======================================================================================================================================================================================
+# Configure logging for all bot actions and messages
+
+# Ensure the logs directory exists
+LOG_FOLDER = "logs"
+
+logger = logging.getLogger(__name__)
+
+os.makedirs(LOG_FOLDER, exist_ok=True)
+
+if os.path.exists("assets/colors.json"):
+    with open("assets/colors.json", "r") as file:
+        colors = json.load(file)
+else:
+    logger.warning('The file "assets/colors.json" is missing. Please download it.')
+
+os.makedirs("logs/images", exist_ok=True)
+
+log_file_path = os.path.join(LOG_FOLDER, "logs.txt")
+
+LOG_MAX_BYTES = config.get("LOG_MAX_BYTES", 10 * 1024 * 1024)  # Rotate logs.txt once it's this big (0 = never)
+LOG_ROTATE_HOURS = config.get("LOG_ROTATE_HOURS", 24)  # Rotate logs.txt once it's this old (0 = never)
+LOG_BACKUP_COUNT = config.get("LOG_BACKUP_COUNT", 14)  # Compressed old logs to keep (0 = keep all)
+
+
+class RotatingLogFile(logging.handlers.RotatingFileHandler):
+    """
+    The log file, rotated by size or age. Old segments are renamed with a timestamp,
+    gzipped in a background thread, and only the newest few are kept.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, rotate_seconds: float, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.rotate_seconds = rotate_seconds
+
+        # A log left over from the last run counts from when it was last written, so an old one still gets rotated
+        try:
+            self.opened_at = os.path.getmtime(self.baseFilename) if os.path.getsize(self.baseFilename) else time.time()
+        except OSError:
+            self.opened_at = time.time()
+
+    def shouldRollover(self, record) -> bool:
+        if self.rotate_seconds and time.time() - self.opened_at >= self.rotate_seconds:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        stem, extension = os.path.splitext(self.baseFilename)
+        segment = f"{stem}-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}{extension}"
+        if os.path.exists(self.baseFilename) and not os.path.exists(segment):
+            os.replace(self.baseFilename, segment)
+            threading.Thread(target=self.compress, args=(segment,), daemon=True).start()
+
+        self.opened_at = time.time()
+        self.stream = self._open()
+
+    def compress(self, segment: str):
+        with open(segment, "rb") as source, gzip.open(f"{segment}.gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(segment)
+
+        if self.backupCount:
+            folder, name = os.path.split(os.path.splitext(self.baseFilename)[0])
+            old_segments = sorted(file for file in os.listdir(folder) if file.startswith(f"{name}-") and file.endswith(".gz"))
+            for file in old_segments[:-self.backupCount]:
+                os.remove(os.path.join(folder, file))
+
+
+# Handlers only put records on a queue, a listener thread does the actual writing.
+# That way logging a message never makes the event loop wait on the disk or the terminal.
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(
+    log_queue,
+    RotatingLogFile(log_file_path, LOG_MAX_BYTES, LOG_ROTATE_HOURS * 3600, LOG_BACKUP_COUNT),
+    logging.StreamHandler(),
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[
+        logging.handlers.QueueHandler(log_queue),
+    ],
+)
+
+log_listener.start()
+atexit.register(log_listener.stop)  # Writes out whatever is still queued
+
+logger.info("\n")
+logger.info("=" * 50)
+logger.info("BOT STARTED")
+logger.info("=" * 50)
+
+# ======================================================================================================================================================================================
+# Text-Logs channel batching
+# Handlers hand their log embeds to the sink and move on. The sink packs up to 10 embeds into each
+# message, which cuts the requests to the log channel by up to 10x when chat is busy.
+
+LOG_BATCH_DELAY = config.get("LOG_BATCH_DELAY", 2)  # Seconds to wait for more embeds before sending
+LOG_QUEUE_SIZE = config.get("LOG_QUEUE_SIZE", 1000)  # Embeds kept in memory before old ones get dropped
+
+
+class LogSink:
+    """Queues log embeds and sends them to the text log channel in batches."""
+
+    MAX_EMBEDS = 10  # Discord's limit per message
+    MAX_CHARACTERS = 6000  # Discord's limit for all embeds in one message combined
+
+    def __init__(self, max_size: int, delay: float):
+        self.queue = collections.deque()
+        self.max_size = max_size
+        self.delay = delay
+        self.batch_ready = asyncio.Event()
+        self.task = None
+        self.dropped = 0  # Since the last warning about it
+        self.dropped_total = 0
+        self.sent_messages = 0
+        self.sent_embeds = 0
+
+    def send(self, embed: discord.Embed):
+        # Never waits, so it's safe to call from any handler
+        if text_log_channel is None:
+            return
+
+        if len(self.queue) >= self.max_size:
+            self.queue.popleft()  # Drop the oldest, the newest logs matter more
+            self.dropped += 1
+            self.dropped_total += 1
+
+        self.queue.append(embed)
+        if len(self.queue) >= self.MAX_EMBEDS:
+            self.batch_ready.set()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        outbound_priority.set(PRIORITY_LOG)
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), timeout=self.delay)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep delivering logs, whatever went wrong with this round
+                logger.error(f"Failed to flush the text log queue: {e}")
+
+    def next_batch(self) -> list[discord.Embed]:
+        batch = []
+        characters = 0
+        while self.queue and len(batch) < self.MAX_EMBEDS:
+            size = len(self.queue[0])
+            if batch and characters + size > self.MAX_CHARACTERS:
+                break
+            batch.append(self.queue.popleft())
+            characters += size
+        return batch
+
+    async def flush(self):
+        if self.dropped:
+            logger.warning(f"Text log queue was full, dropped {self.dropped} log embeds.")
+            self.dropped = 0
+
+        while self.queue and text_log_channel is not None:
+            batch = self.next_batch()
+            try:
+                await text_log_channel.send(embeds=batch)
+            except OutboundShed:
+                # The bot is busy, put the batch back and try again on the next round
+                self.queue.extendleft(reversed(batch))
+                break
+            except discord.HTTPException as e:
+                if e.status == 400 and len(batch) > 1:
+                    # One invalid embed rejects the whole message, so send them one by one to only lose that one
+                    if not await self.send_each(batch):
+                        break
+                    continue
+                logger.error(f"Failed to send {len(batch)} log embeds: {e}")
+                continue
+            self.sent_messages += 1
+            self.sent_embeds += len(batch)
+
+    async def send_each(self, batch: list[discord.Embed]) -> bool:
+        # Returns False if the bot got busy and the rest of the batch was put back in the queue
+        for index, embed in enumerate(batch):
+            try:
+                await text_log_channel.send(embed=embed)
+            except OutboundShed:
+                self.queue.extendleft(reversed(batch[index:]))
+                return False
+            except discord.HTTPException as e:
+                logger.error(f"Failed to send log embed '{embed.title}': {e}")
+                continue
+            self.sent_messages += 1
+            self.sent_embeds += 1
+        return True
+
+
+log_sink = LogSink(LOG_QUEUE_SIZE, LOG_BATCH_DELAY)
+
+# ======================================================================================================================================================================================
+# Write-behind persistence
+# Stores keep their data in memory and only remember what changed. A background loop writes
+# those changes to disk in batches, so commands and events never wait on file I/O.
+
+FLUSH_INTERVAL = config.get("FLUSH_INTERVAL", 5)  # Seconds between background saves
+
+write_behind_stores = []
+flush_lock = asyncio.Lock()
+
+
+def read_json(path, default):
+    # Returns the parsed file, or the default if it's missing or corrupted
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def write_json_atomic(path, data, indent=4):
+    # Write to a temp file first and swap it in, so a crash never leaves a half-written file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(data, file, indent=indent)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+class JsonObjectFile:
+    """A JSON object file on disk, rewritten atomically whenever a batch of changes is applied."""
+
+    def __init__(self, path: str, indent: int | None = 4):
+        self.path = path
+        self.indent = indent
+        self.data = {}
+
+    def load(self) -> dict:
+        if not os.path.exists(self.path):
+            write_json_atomic(self.path, {}, self.indent)
+        self.data = read_json(self.path, {})
+
+        # The store gets its own copy; this one is only touched by the writer thread
+        return json.loads(json.dumps(self.data))
+
+    def apply(self, changes: dict):
+        for key, value in changes.items():
+            if value is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = value
+        write_json_atomic(self.path, self.data, self.indent)
+
+
+class JournaledJsonObjectFile(JsonObjectFile):
+    """
+    A JSON object file where each batch of changes is appended to a journal instead of rewriting
+    the whole file. Once the journal gets long it's folded back into the main file.
+    """
+
+    def __init__(self, path: str, journal_path: str, indent: int | None = 4, compact_threshold: int = 500):
+        super().__init__(path, indent)
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.journal_count = 0
+
+    def load(self) -> dict:
+        data = super().load()
+
+        # Replay changes that weren't folded into the main file before the bot stopped
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by a crash
+                    for target in (self.data, data):
+                        if record["value"] is None:
+                            target.pop(record["key"], None)
+                        else:
+                            target[record["key"]] = record["value"]
+                    self.journal_count += 1
+
+        return data
+
+    def apply(self, changes: dict):
+        with open(self.journal_path, "a") as journal:
+            for key, value in changes.items():
+                journal.write(json.dumps({"key": key, "value": value}) + "\n")
+                if value is None:
+                    self.data.pop(key, None)
+                else:
+                    self.data[key] = value
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self.journal_count += len(changes)
+        if self.journal_count >= self.compact_threshold:
+            self.compact()
+
+    def compact(self):
+        write_json_atomic(self.path, self.data, self.indent)
+
+        # Replaying the journal again is harmless, so a crash before this line loses nothing
+        open(self.journal_path, "w").close()
+        self.journal_count = 0
+
+
+class WriteBehindStore(abc.ABC):
+    """Base for in-memory stores that are saved by the background flush loop."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.dirty = set()
+        write_behind_stores.append(self)
+
+    @abc.abstractmethod
+    def snapshot(self, key):
+        # Return a copy of the record for "key", or None if it was deleted
+        ...
+
+    def collect(self):
+        # Runs on the event loop, so the copies are consistent with what commands see
+        changes = {key: self.snapshot(key) for key in self.dirty}
+        self.dirty.clear()
+        return changes
+
+    def restore(self, changes):
+        # A write failed, try again on the next flush
+        self.dirty.update(changes)
+
+
+# ======================================================================================================================================================================================
+# SQLite storage backend
+# Set "STORAGE_BACKEND" to "sqlite" in config.json to keep everything in one database instead of the JSON files.
+# Run /migrate once (while still on "json") to copy the existing JSON data over.
+
+STORAGE_BACKEND = config.get("STORAGE_BACKEND", "json").lower()
+DATABASE_FILE = "moderation/bot_data.db"
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tickets (user_id TEXT PRIMARY KEY, "channel_id" INTEGER, "status" TEXT, "date" TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tickets_channel_id ON tickets ("channel_id");
+CREATE INDEX IF NOT EXISTS tickets_date ON tickets ("date");
+
+CREATE TABLE IF NOT EXISTS bans (user_id TEXT PRIMARY KEY, "user" TEXT, "date" TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS bans_user ON bans ("user" COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS bans_date ON bans ("date");
+
+CREATE TABLE IF NOT EXISTS afk (user_id TEXT PRIMARY KEY, "time" REAL, data TEXT NOT NULL);
+
+CREATE TABLE IF NOT EXISTS timers ("key" TEXT PRIMARY KEY, "action" TEXT, "due" REAL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS timers_due ON timers ("due");
+
+CREATE TABLE IF NOT EXISTS warns (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "date" TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS warns_user_id ON warns (user_id);
+CREATE INDEX IF NOT EXISTS warns_date ON warns ("date");
+"""
+
+# Record fields copied into their own (indexed) columns, next to the full JSON record
+SQLITE_TABLE_COLUMNS = {
+    "tickets": ("channel_id", "status", "date"),
+    "bans": ("user", "date"),
+    "afk": ("time",),
+    "timers": ("action", "due"),
+}
+
+
+class SQLiteStorage:
+    """
+    One SQLite database in WAL mode shared by every store. After startup it's only used from
+    worker threads (the flush loop runs writes through asyncio.to_thread), never on the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SQLITE_SCHEMA)
+
+    def query(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def transaction(self, statements: list):
+        # Every (sql, rows) pair is committed together, or not at all
+        with self.lock, self.connection:
+            for sql, rows in statements:
+                if rows:
+                    self.connection.executemany(sql, rows)
+
+
+class SQLiteTable:
+    """Backend for the stores keyed by user ID (tickets, bans, AFK) or another key: one row per record."""
+
+    def __init__(self, storage: SQLiteStorage, table: str, key: str = "user_id"):
+        self.storage = storage
+        self.table = table
+        self.key = key
+        self.columns = SQLITE_TABLE_COLUMNS[table]
+
+    def load(self) -> dict:
+        return {key: json.loads(data) for key, data in self.storage.query(f'SELECT "{self.key}", data FROM {self.table}')}
+
+    def statements(self, changes: dict) -> list:
+        upserts = []
+        deletes = []
+        for key, record in changes.items():
+            if record is None:
+                deletes.append((key,))
+            else:
+                upserts.append((key, *(record.get(column) for column in self.columns), json.dumps(record)))
+
+        names = ", ".join([f'"{self.key}"', *(f'"{column}"' for column in self.columns), "data"])
+        placeholders = ", ".join("?" * (len(self.columns) + 2))
+        return [
+            (f"INSERT OR REPLACE INTO {self.table} ({names}) VALUES ({placeholders})", upserts),
+            (f'DELETE FROM {self.table} WHERE "{self.key}" = ?', deletes),
+        ]
+
+    def apply(self, changes: dict):
+        self.storage.transaction(self.statements(changes))
+
+
+class SQLiteWarnLog:
+    """Backend for the warn ledger: one row per warning, so adding one never rewrites the rest."""
+
+    def __init__(self, storage: SQLiteStorage):
+        self.storage = storage
+
+    def load(self) -> dict:
+        warns = {}
+        for user_id, data in self.storage.query("SELECT user_id, data FROM warns ORDER BY id"):
+            warns.setdefault(user_id, []).append(json.loads(data))
+        return warns
+
+    def statements(self, entries: list) -> list:
+        rows = [(user_id, warn.get("date"), json.dumps(warn)) for user_id, warn in entries]
+        return [('INSERT INTO warns (user_id, "date", data) VALUES (?, ?, ?)', rows)]
+
+    def apply(self, entries: list):
+        self.storage.transaction(self.statements(entries))
+
+
+database = SQLiteStorage(DATABASE_FILE) if STORAGE_BACKEND == "sqlite" else None
+
+# ======================================================================================================================================================================================
+# Flushing the stores
+
+async def flush_stores():
+    async with flush_lock:
+        for store in write_behind_stores:
+            changes = store.collect()
+            if not changes:
+                continue
+            try:
+                await asyncio.to_thread(store.backend.apply, changes)
+            except (OSError, sqlite3.Error, TypeError, ValueError) as e:
+                # Nothing is lost, the changes are saved again on the next flush
+                store.restore(changes)
+                logger.error(f"Failed to save {type(store).__name__}, retrying on the next flush: {e!r}")
+
+
+@tasks.loop(seconds=FLUSH_INTERVAL)
+async def flush_loop():
+    await flush_stores()
+
+# ======================================================================================================================================================================================
+# Configure modmail logging
+
+MODMAIL_LOG_FILE = "logs/modmail_logs.json"
+
+
+class ModmailStore(WriteBehindStore):
+    """Modmail tickets kept in memory, indexed by channel ID and by users with an open ticket."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+
+        # Same layout as modmail_logs.json: user ID (as a string) -> latest ticket
+        self.tickets = backend.load()
+        self.by_channel = {}
+        self.open_by_user = {}
+
+        for user_id, ticket in self.tickets.items():
+            self._index(user_id, ticket)
+
+    def _index(self, user_id: str, ticket: dict):
+        self.by_channel[ticket["channel_id"]] = user_id
+        if ticket["status"] == "open":
+            self.open_by_user[user_id] = ticket
+        else:
+            self.open_by_user.pop(user_id, None)
+
+    def snapshot(self, key):
+        ticket = self.tickets.get(key)
+        if ticket is None:
+            return None
+        ticket = dict(ticket)
+        if "transcripts" in ticket:
+            ticket["transcripts"] = list(ticket["transcripts"])  # Can still grow while it's being saved
+        return ticket
+
+    def get_open(self, user_id: str) -> dict | None:
+        return self.open_by_user.get(user_id)
+
+    def find_by_channel(self, channel_id: int) -> tuple[str | None, dict | None]:
+        user_id = self.by_channel.get(channel_id)
+        if user_id is None:
+            return None, None
+        return user_id, self.tickets[user_id]
+
+    def open_ticket(self, user_id: str, ticket: dict):
+        # A user only keeps their latest ticket, so forget the old channel
+        previous = self.tickets.get(user_id)
+        if previous is not None:
+            self.by_channel.pop(previous["channel_id"], None)
+
+            # Transcripts of earlier tickets stay with the user
+            if "transcripts" in previous:
+                ticket.setdefault("transcripts", previous["transcripts"])
+
+        self.tickets[user_id] = ticket
+        self._index(user_id, ticket)
+        self.dirty.add(user_id)
+
+    def set_status(self, channel_id: int, status: str) -> str | None:
+        user_id, ticket = self.find_by_channel(channel_id)
+        if ticket is None:
+            return None
+
+        ticket["status"] = status
+        self._index(user_id, ticket)
+        self.dirty.add(user_id)
+        return user_id
+
+    def add_transcript(self, user_id: str, transcript: dict):
+        ticket = self.tickets.get(user_id)
+        if ticket is None:
+            return
+        ticket.setdefault("transcripts", []).append(transcript)
+        self.dirty.add(user_id)
+
+
+modmail_store = ModmailStore(SQLiteTable(database, "tickets") if database else JsonObjectFile(MODMAIL_LOG_FILE))
+
+# ======================================================================================================================================================================================
+# Modmail categories
+# A category holds at most 50 channels, so busy servers run out of room under MODMAIL_CATEGORY_ID. When every
+# modmail category is full, an overflow category ("Modmail 2", "Modmail 3", ...) is made with the same
+# permissions, and new tickets go to whichever category has the most room. Channel counts are read once at
+# startup and kept up to date by the channel events, so picking a category never walks the guild's channels.
+
+MODMAIL_CATEGORY_LIMIT = 50  # Discord's limit of channels per category
+MODMAIL_MAX_CATEGORIES = config.get("MODMAIL_MAX_CATEGORIES", 5)  # Modmail category plus overflow categories at most
+
+
+class ModmailCategories:
+    """The modmail category and its overflow categories, with the channels each one holds."""
+
+    def __init__(self, primary_id: int, max_categories: int):
+        self.primary_id = primary_id
+        self.max_categories = max_categories
+        self.channels = {}  # Category ID -> IDs of the channels in it
+        self.reserved = collections.Counter()  # Category ID -> channels being created in it right now
+        self.lock = asyncio.Lock()
+
+    def __contains__(self, category_id: int) -> bool:
+        return category_id in self.channels
+
+    @staticmethod
+    def overflow_name(primary: discord.CategoryChannel, number: int) -> str:
+        return f"{primary.name} {number}"
+
+    def load(self, guild: discord.Guild):
+        # Only at startup, the channel events keep it up to date after that
+        primary = guild.get_channel(self.primary_id)
+        if primary is None:
+            return
+        names = {self.overflow_name(primary, number) for number in range(2, self.max_categories + 1)}
+        self.channels = {
+            category.id: {channel.id for channel in category.channels}
+            for category in guild.categories if category.id == self.primary_id or category.name in names
+        }
+
+    def occupancy(self, category_id: int) -> int:
+        return len(self.channels[category_id]) + self.reserved[category_id]
+
+    async def reserve(self, guild: discord.Guild) -> discord.CategoryChannel | None:
+        # The category with the most room, making an overflow category if they're all full (None if that's not allowed)
+        async with self.lock:
+            category_id = min(self.channels, key=lambda category_id: (self.occupancy(category_id), category_id != self.primary_id), default=None)
+            if category_id is None:
+                return None
+            if self.occupancy(category_id) >= MODMAIL_CATEGORY_LIMIT:
+                if len(self.channels) >= self.max_categories:
+                    logger.warning(f"All {len(self.channels)} modmail categories are full.")
+                    return None
+                category_id = (await self.create_overflow(guild)).id
+
+            self.reserved[category_id] += 1
+            return guild.get_channel(category_id)
+
+    def release(self, category_id: int, channel: discord.abc.GuildChannel | None = None):
+        self.reserved[category_id] -= 1
+        if self.reserved[category_id] <= 0:
+            del self.reserved[category_id]
+        if channel is not None and category_id in self.channels:
+            self.channels[category_id].add(channel.id)
+
+    async def create_overflow(self, guild: discord.Guild) -> discord.CategoryChannel:
+        primary = guild.get_channel(self.primary_id)
+        taken = {category.name for category in guild.categories}
+        number = next(number for number in range(2, self.max_categories + 2) if self.overflow_name(primary, number) not in taken)
+
+        category = await guild.create_category(
+            name=self.overflow_name(primary, number),
+            overwrites=primary.overwrites,
+            position=primary.position + 1,
+            reason="Modmail overflow category"
+        )
+        self.channels.setdefault(category.id, set())
+        logger.info(f"Created modmail overflow category '{category.name}'.")
+        return category
+
+    def track(self, channel: discord.abc.GuildChannel):
+        if channel.category_id in self.channels:
+            self.channels[channel.category_id].add(channel.id)
+
+    def untrack(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.CategoryChannel):
+            self.channels.pop(channel.id, None)
+            return
+        if channel.category_id not in self.channels:
+            return
+
+        self.channels[channel.category_id].discard(channel.id)
+        # Overflow categories go away again once their last channel does
+        if channel.category_id != self.primary_id and self.occupancy(channel.category_id) == 0:
+            run_in_background(self.remove_if_empty(channel.category), f"removing modmail category {channel.category_id}")
+
+    async def remove_if_empty(self, category: discord.CategoryChannel | None):
+        async with self.lock:
+            if category is None or category.id not in self.channels or self.occupancy(category.id):
+                return
+            try:
+                await category.delete(reason="Modmail overflow category is empty")
+                self.channels.pop(category.id, None)
+                logger.info(f"Removed the empty modmail overflow category '{category.name}'.")
+            except discord.HTTPException as e:
+                logger.error(f"Failed to remove the empty modmail overflow category '{category.name}': {e}")
+
+
+modmail_categories = ModmailCategories(MODMAIL_CATEGORY_ID, MODMAIL_MAX_CATEGORIES)
+
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    modmail_categories.track(channel)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    modmail_categories.untrack(channel)
+
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if before.category_id != after.category_id:
+        modmail_categories.untrack(before)
+        modmail_categories.track(after)
+
+# ======================================================================================================================================================================================
+# Modmail ticket creation
+# Only one ticket is ever being created per user: a second "contact" while the first is still in progress
+# waits for the same channel instead of making another. With MODMAIL_WARM_POOL set, a few hidden channels
+# are made ahead of time, so opening a ticket is a single edit that renames and unhides one of them.
+
+MODMAIL_WARM_POOL = config.get("MODMAIL_WARM_POOL", 0)  # Hidden spare ticket channels kept ready (0 = create them on demand)
+MODMAIL_SPARE_NAME = "spare-ticket"
+
+modmail_creations = {}  # user ID -> task creating their ticket
+
+
+def modmail_overwrites(guild: discord.Guild, user: discord.abc.User) -> dict:
+    overwrites = {
+        guild.default_role: discord.PermissionOverwrite(read_messages=False),
+        user: discord.PermissionOverwrite(read_messages=True, send_messages=True),
+    }
+
+    # Add permissions for allowed roles
+    for role_id in MOD_ROLE_ID:
+        role = guild.get_role(role_id)
+        if role:
+            overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+    return overwrites
+
+
+class ModmailChannelPool:
+    """Hidden channels made ahead of time under the modmail categories, claimed when a ticket opens."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.channels = collections.deque()  # Spare channel IDs
+        self.refill_task = None
+
+    def adopt(self, guild: discord.Guild):
+        # Spare channels left over from before a restart
+        for category_id in modmail_categories.channels:
+            category = guild.get_channel(category_id)
+            for channel in category.text_channels if category is not None else ():
+                if channel.name == MODMAIL_SPARE_NAME and channel.id not in self.channels:
+                    self.channels.append(channel.id)
+
+    def claim(self, guild: discord.Guild) -> discord.TextChannel | None:
+        while self.channels:
+            channel = guild.get_channel(self.channels.popleft())
+            if channel is not None:
+                return channel
+        return None
+
+    def refill(self, guild: discord.Guild):
+        if self.size and self.refill_task is None:
+            self.refill_task = asyncio.create_task(self.run_refill(guild))
+
+    async def run_refill(self, guild: discord.Guild):
+        outbound_priority.set(PRIORITY_NOTICE)
+        try:
+            while len(self.channels) < self.size:
+                category = await modmail_categories.reserve(guild)
+                if category is None:
+                    break
+                channel = None
+                try:
+                    channel = await guild.create_text_channel(
+                        name=MODMAIL_SPARE_NAME,
+                        category=category,
+                        overwrites={guild.default_role: discord.PermissionOverwrite(read_messages=False)},
+                        reason="Spare modmail channel"
+                    )
+                finally:
+                    modmail_categories.release(category.id, channel)
+                self.channels.append(channel.id)
+        except discord.HTTPException as e:
+            logger.error(f"Failed to create a spare modmail channel: {e}")
+        finally:
+            self.refill_task = None
+
+
+modmail_pool = ModmailChannelPool(MODMAIL_WARM_POOL)
+
+
+def prepare_modmail():
+    # Runs from on_ready, once the categories can be found
+    guild = bot.get_guild(GUILD_ID)
+    if guild is None:
+        return
+    modmail_categories.load(guild)
+    if MODMAIL_WARM_POOL:
+        modmail_pool.adopt(guild)
+        modmail_pool.refill(guild)
+
+
+async def create_modmail_ticket(guild: discord.Guild, user: discord.abc.User) -> discord.TextChannel | None:
+    # Returns None if every modmail category is full
+    overwrites = modmail_overwrites(guild, user)
+    channel_name = f"{user.name}"
+
+    # A spare channel only needs renaming and unhiding
+    channel = modmail_pool.claim(guild)
+    if channel is not None:
+        try:
+            await channel.edit(name=channel_name, topic=f"Modmail thread for {user}", overwrites=overwrites, reason="Modmail channel creation")
+        except discord.NotFound:
+            channel = None
+    if channel is None:
+        category = await modmail_categories.reserve(guild)
+        if category is None:
+            return None
+        try:
+            # Create the channel
+            channel = await guild.create_text_channel(
+                name=channel_name,
+                category=category,
+                overwrites=overwrites,
+                topic=f"Modmail thread for {user}",
+                reason="Modmail channel creation"
+            )
+        finally:
+            modmail_categories.release(category.id, channel)
+    modmail_pool.refill(guild)
+
+    # Saved before anything is sent, so the open ticket check sees it straight away
+    modmail_store.open_ticket(str(user.id), {
+        "user": user.name,
+        "user_id": user.id,
+        "channel_id": channel.id,
+        "status": "open",
+        "date": str(datetime.datetime.now(datetime.UTC))
+    })
+    if MODMAIL_IDLE_HOURS:
+        timer_store.schedule("modmail_close", channel.id, time.time() + MODMAIL_IDLE_HOURS * 3600)
+
+    embed = discord.Embed(
+        title="📃 Modmail Thread",
+        description=f"> Modmail initiated by {user.mention}. \n> \n> Please describe your issue and how we can assist you.",
+        color=colors["blue"]
+    )
+    embed.set_footer(text="Use the buttons below to manage this thread.")
+
+    view = ModmailView(guild=guild, allowed_roles=[MOD_ROLE_ID, ADMIN_ROLE_ID, SERVICER_ROLE_ID])
+    await channel.send(f"### {MOD_ROLE_MENTION} Come help!", embed=embed, view=view)
+    return channel
+
+# ======================================================================================================================================================================================
+# Modmail relay
+# Users with an open ticket can keep talking in DMs: their messages are posted in the ticket channel through
+# a webhook under their own name and avatar, and staff messages in the channel are sent back to their DMs.
+# Each ticket and direction gets its own short-lived worker, so a slow user never holds up another ticket,
+# and messages sent in quick succession go out together. Attachments are streamed into a temporary file
+# that only spills to disk once it's big, instead of being read into memory whole.
+
+MODMAIL_RELAY_DELAY = config.get("MODMAIL_RELAY_DELAY", 1)  # Seconds to wait for more messages before relaying a burst
+MODMAIL_RELAY_WEBHOOK = "Modmail Relay"
+RELAY_FILE_LIMIT = 25 * 1024 * 1024  # Bigger attachments are relayed as links
+RELAY_MAX_FILES = 10  # Discord's limit per message
+RELAY_MAX_CONTENT = 2000  # Discord's limit for message content
+
+
+class ModmailRelay:
+    """Forwards DMs into ticket channels and staff replies back to the user."""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.pending = {}  # (direction, channel ID) -> messages waiting to be relayed
+        self.webhooks = {}  # channel ID -> webhook
+        self.tasks = set()
+        self.session = None
+
+    def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+
+    async def stop(self):
+        # Give relays that are still running a moment to finish before shutting down
+        if self.tasks:
+            await asyncio.wait(self.tasks, timeout=10)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def forward(self, direction: str, channel_id: int, message: discord.Message):
+        # direction is "ticket" (DM to channel) or "user" (channel to DM)
+        key = (direction, channel_id)
+        batch = self.pending.get(key)
+        if batch is not None:
+            batch.append(message)  # The worker for this ticket picks it up
+            return
+
+        self.pending[key] = [message]
+        task = asyncio.create_task(self.run(key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def forget(self, channel_id: int):
+        self.webhooks.pop(channel_id, None)
+
+    async def run(self, key: tuple[str, int]):
+        outbound_priority.set(PRIORITY_MODMAIL)
+        try:
+            await asyncio.sleep(self.delay)  # Let the rest of the burst arrive
+            while True:
+                messages = self.pending[key]
+                self.pending[key] = []  # Anything sent meanwhile goes out next round
+                try:
+                    if key[0] == "ticket":
+                        await self.to_ticket(key[1], messages)
+                    else:
+                        await self.to_user(key[1], messages)
+                except Exception as e:
+                    logger.error(f"Failed to relay {len(messages)} modmail messages ({key[0]}, channel {key[1]}): {e!r}")
+
+                if not self.pending[key]:
+                    return
+        finally:
+            # Whatever happens, the next message for this ticket starts a new worker
+            self.pending.pop(key, None)
+
+    async def webhook(self, channel: discord.TextChannel) -> discord.Webhook:
+        webhook = self.webhooks.get(channel.id)
+        if webhook is None:
+            webhook = discord.utils.get(await channel.webhooks(), name=MODMAIL_RELAY_WEBHOOK)
+            if webhook is None:
+                webhook = await channel.create_webhook(name=MODMAIL_RELAY_WEBHOOK, reason="Modmail relay")
+            self.webhooks[channel.id] = webhook
+        return webhook
+
+    async def to_ticket(self, channel_id: int, messages: list[discord.Message]):
+        channel = bot.get_channel(channel_id)
+        if channel is None:
+            return
+        user = messages[0].author
+        webhook = await self.webhook(channel)
+
+        lines = [message.content for message in messages if message.content]
+        files, links = await self.download(messages)
+        try:
+            await self.send_chunks(
+                lambda content, files: webhook.send(
+                    content=content, files=files, username=user.display_name, avatar_url=user.display_avatar.url,
+                    allowed_mentions=discord.AllowedMentions.none()
+                ),
+                lines + links, files
+            )
+        except discord.NotFound:
+            self.forget(channel_id)  # Deleted by hand, made again next time
+            raise
+        finally:
+            for file in files:
+                file.close()
+
+    async def to_user(self, channel_id: int, messages: list[discord.Message]):
+        user_id, ticket = modmail_store.find_by_channel(channel_id)
+        if ticket is None or ticket["status"] != "open":
+            return
+        user = bot.get_user(ticket["user_id"]) or await bot.fetch_user(ticket["user_id"])
+
+        lines = [f"**{message.author.display_name}:** {message.content}" for message in messages if message.content]
+        files, links = await self.download(messages)
+        try:
+            await self.send_chunks(
+                lambda content, files: user.send(content=content, files=files, allowed_mentions=discord.AllowedMentions.none()),
+                lines + links, files
+            )
+        except discord.Forbidden:
+            logger.info(f"Could not relay staff replies to {user}, they may have DMs disabled.")
+        finally:
+            for file in files:
+                file.close()
+
+    async def send_chunks(self, send, lines: list[str], files: list[discord.File]):
+        # As few messages as fit, the files go with the last one
+        chunks = []
+        current = ""
+        for line in lines:
+            for start in range(0, len(line), RELAY_MAX_CONTENT):
+                part = line[start:start + RELAY_MAX_CONTENT]
+                if current and len(current) + 1 + len(part) > RELAY_MAX_CONTENT:
+                    chunks.append(current)
+                    current = ""
+                current = f"{current}\n{part}" if current else part
+        chunks.append(current)
+
+        outgoing = [(content, None) for content in chunks]
+        for start in range(0, len(files), RELAY_MAX_FILES):
+            batch = files[start:start + RELAY_MAX_FILES]
+            if start == 0:
+                outgoing[-1] = (outgoing[-1][0], batch)
+            else:
+                outgoing.append(("", batch))
+
+        for content, batch in outgoing:
+            if content or batch:
+                await send(content or None, batch)
+
+    async def download(self, messages: list[discord.Message]) -> tuple[list[discord.File], list[str]]:
+        files = []
+        links = []
+        for message in messages:
+            for attachment in message.attachments:
+                if attachment.size > RELAY_FILE_LIMIT:
+                    links.append(f"[{attachment.filename}]({attachment.url})")
+                    continue
+
+                try:
+                    file = await self.stream_to_file(attachment.url)
+                except (aiohttp.ClientError, OSError) as e:
+                    logger.warning(f"Failed to download '{attachment.filename}' for the modmail relay: {e}")
+                    links.append(f"[{attachment.filename}]({attachment.url})")
+                    continue
+                files.append(discord.File(file, filename=attachment.filename))
+        return files, links
+
+    async def stream_to_file(self, url: str):
+        # Kept in memory while small. Once it isn't, the rest is written to a temp file in a thread,
+        # so the event loop never waits on the disk (the upload reads it back in a thread too).
+        buffer = []
+        size = 0
+        file = None
+        try:
+            async with self.session.get(url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if file is None:
+                        buffer.append(chunk)
+                        if size > IMAGE_MEMORY_BUFFER:
+                            file = await asyncio.to_thread(tempfile.TemporaryFile)
+                            await asyncio.to_thread(file.writelines, buffer)
+                            buffer = []
+                    else:
+                        await asyncio.to_thread(file.write, chunk)
+        except BaseException:
+            if file is not None:
+                await asyncio.to_thread(file.close)
+            raise
+
+        if file is None:
+            return io.BytesIO(b"".join(buffer))
+        await asyncio.to_thread(file.seek, 0)
+        return file
+
+
+modmail_relay = ModmailRelay(MODMAIL_RELAY_DELAY)
+
+# ======================================================================================================================================================================================
+# Modmail transcripts
+# Closing a ticket saves the conversation before the channel is deleted. The history is read a page at a
+# time, and each page is written out (gzipped JSON lines plus a readable text version) before the next one
+# is fetched, so even a huge ticket never sits in memory. It all runs in the background.
+
+TRANSCRIPT_FOLDER = "logs/transcripts"
+TRANSCRIPT_UPLOAD = config.get("TRANSCRIPT_UPLOAD", True)  # Upload the text transcript to the text log channel
+TRANSCRIPT_PAGE_SIZE = 100  # Messages per history request, Discord's maximum
+TRANSCRIPT_UPLOAD_LIMIT = 25 * 1024 * 1024
+
+transcript_tasks = set()
+
+
+def transcript_record(message: discord.Message) -> str:
+    return json.dumps({
+        "id": message.id,
+        "date": message.created_at.isoformat(),
+        "author": str(message.author),
+        "author_id": message.author.id,
+        "bot": message.author.bot,
+        "content": message.content,
+        "attachments": [attachment.url for attachment in message.attachments],
+        "embeds": [embed.to_dict() for embed in message.embeds],
+    }) + "\n"
+
+
+def transcript_line(message: discord.Message) -> str:
+    lines = [f"[{message.created_at.strftime('%Y-%m-%d %H:%M:%S')}] {message.author} ({message.author.id}): {message.content}"]
+    for embed in message.embeds:
+        lines.append(f"    [Embed] {embed.title or ''} {embed.description or ''}".rstrip())
+    for attachment in message.attachments:
+        lines.append(f"    [Attachment] {attachment.url}")
+    return "\n".join(lines) + "\n"
+
+
+def write_transcript_page(files: list, pages: list[list[str]]):
+    for file, lines in zip(files, pages):
+        file.writelines(lines)
+
+
+async def export_transcript(channel: discord.TextChannel, user_id: str, ticket: dict) -> dict:
+    folder = os.path.join(TRANSCRIPT_FOLDER, user_id)
+    name = f"{ticket['date'][:10]}_{channel.id}"
+    jsonl_path = os.path.join(folder, f"{name}.jsonl.gz")
+    text_path = os.path.join(folder, f"{name}.txt.gz")
+
+    await asyncio.to_thread(os.makedirs, folder, exist_ok=True)
+    files = await asyncio.to_thread(lambda: [gzip.open(jsonl_path, "wt", encoding="utf-8"), gzip.open(text_path, "wt", encoding="utf-8")])
+    count = 0
+    try:
+        records = []
+        lines = [f"Modmail transcript for {ticket['user']} ({user_id}), opened {ticket['date']}\n\n"]
+        async for message in channel.history(limit=None, oldest_first=True):
+            records.append(transcript_record(message))
+            lines.append(transcript_line(message))
+            if len(records) >= TRANSCRIPT_PAGE_SIZE:
+                await asyncio.to_thread(write_transcript_page, files, [records, lines])
+                count += len(records)
+                records, lines = [], []
+
+        await asyncio.to_thread(write_transcript_page, files, [records, lines])
+        count += len(records)
+    finally:
+        await asyncio.to_thread(lambda: [file.close() for file in files])
+
+    return {
+        "date": ticket["date"],
+        "closed": str(datetime.datetime.now(datetime.UTC)),
+        "channel_id": channel.id,
+        "messages": count,
+        "jsonl": jsonl_path,
+        "text": text_path,
+    }
+
+
+async def upload_transcript(user_id: str, ticket: dict, transcript: dict):
+    if text_log_channel is None:
+        return
+    if os.path.getsize(transcript["text"]) > TRANSCRIPT_UPLOAD_LIMIT:
+        logger.warning(f"Transcript {transcript['text']} is too big to upload, it's only saved on disk.")
+        return
+
+    embed = discord.Embed(
+        title="📃 Modmail Transcript",
+        description=(
+            f"> **User:** {ticket['user']} (`{user_id}`)\n"
+            f"> **Opened:** {ticket['date']}\n"
+            f"> **Messages:** {transcript['messages']}"
+        ),
+        color=colors["blue"]
+    )
+    outbound_priority.set(PRIORITY_LOG)
+    try:
+        await text_log_channel.send(embed=embed, file=discord.File(transcript["text"], filename=os.path.basename(transcript["text"])))
+    except (OutboundShed, discord.HTTPException) as e:
+        logger.warning(f"Failed to upload transcript {transcript['text']} (it's still saved): {e}")
+
+
+async def close_ticket(channel: discord.TextChannel, reason: str):
+    # Saves the transcript first, the channel is deleted either way
+    outbound_priority.set(PRIORITY_MODMAIL)
+    user_id, ticket = modmail_store.find_by_channel(channel.id)
+    transcript = None
+    if ticket is not None:
+        try:
+            transcript = await export_transcript(channel, user_id, ticket)
+            modmail_store.add_transcript(user_id, transcript)
+            logger.info(f"Saved {transcript['messages']} messages from ticket '{channel.name}' to {transcript['jsonl']}.")
+        except (discord.HTTPException, OSError) as e:
+            logger.error(f"Failed to save the transcript of ticket '{channel.name}': {e}")
+
+    modmail_relay.forget(channel.id)
+    await channel.delete(reason=reason)
+
+    if transcript is not None and TRANSCRIPT_UPLOAD:
+        await upload_transcript(user_id, ticket, transcript)
+
+
+def start_ticket_close(channel: discord.TextChannel, reason: str):
+    # Keep a reference, or the task could be garbage collected halfway through
+    task = asyncio.create_task(close_ticket(channel, reason))
+    transcript_tasks.add(task)
+    task.add_done_callback(transcript_tasks.discard)
+
+# ======================================================================================================================================================================================
+# AFK storage
+
+class AfkStore(WriteBehindStore):
+    """AFK users kept in memory. on_message only touches this dict, the flush loop saves it."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.users = backend.load()  # user ID (as a string) -> {"reason": ..., "time": ...}
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.users
+
+    def get(self, user_id: str) -> dict | None:
+        return self.users.get(user_id)
+
+    def set(self, user_id: str, reason: str):
+        self.users[user_id] = {"reason": reason, "time": time.time()}
+        self.dirty.add(user_id)
+
+    def remove(self, user_id: str):
+        if self.users.pop(user_id, None) is not None:
+            self.dirty.add(user_id)
+
+    def snapshot(self, key):
+        afk_info = self.users.get(key)
+        return dict(afk_info) if afk_info is not None else None
+
+
+afk_store = AfkStore(SQLiteTable(database, "afk") if database else JsonObjectFile(AFK_FILE, indent=None))
+
+# ======================================================================================================================================================================================
+# Timed actions
+# Temp bans, mutes, AFK status and idle modmail tickets all end at a set time. Each one is saved with its
+# due time and kept in a heap, and one task sleeps until the earliest is due, so waiting timers cost nothing.
+# Due timers run in batches, a few at a time, and are only removed once they're done, so anything cut
+# short by a restart runs again once on_ready re-arms the scheduler.
+
+TIMER_FILE = os.path.join("moderation", "timers.json")
+TIMER_JOURNAL_FILE = os.path.join("moderation", "timers_journal.jsonl")
+TIMER_BATCH_SIZE = 100
+TIMER_CONCURRENCY = config.get("TIMER_CONCURRENCY", 5)  # Timed actions running at the same time
+AFK_EXPIRE_HOURS = config.get("AFK_EXPIRE_HOURS", 24)  # AFK status is cleared after this long (0 = never)
+MODMAIL_IDLE_HOURS = config.get("MODMAIL_IDLE_HOURS", 72)  # Tickets without messages for this long are closed (0 = never)
+
+
+class TimerStore(WriteBehindStore):
+    """Pending timed actions with a heap of due times, saved by the flush loop like the other stores."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.timers = backend.load()  # "action:target_id" -> {"action": ..., "target_id": ..., "due": ..., ...}
+        self.heap = [(timer["due"], key) for key, timer in self.timers.items()]
+        heapq.heapify(self.heap)
+        self.changed = asyncio.Event()
+        self.task = None
+
+    def snapshot(self, key):
+        timer = self.timers.get(key)
+        return dict(timer) if timer is not None else None
+
+    def schedule(self, action: str, target_id: int, due: float, **data):
+        # Replaces any pending timer for the same action and target
+        key = f"{action}:{target_id}"
+        self.timers[key] = {"action": action, "target_id": target_id, "due": due, **data}
+        self.dirty.add(key)
+        heapq.heappush(self.heap, (due, key))
+        if self.heap[0] == (due, key):
+            self.changed.set()  # Due sooner than whatever the runner is waiting on
+
+    def cancel(self, action: str, target_id: int):
+        # The heap entry is skipped when it comes up
+        key = f"{action}:{target_id}"
+        if self.timers.pop(key, None) is not None:
+            self.dirty.add(key)
+
+    def pending(self, action: str) -> list[dict]:
+        return [timer for timer in self.timers.values() if timer["action"] == action]
+
+    def next_due(self) -> float | None:
+        # Drop heap entries for timers that were cancelled or rescheduled
+        while self.heap:
+            due, key = self.heap[0]
+            timer = self.timers.get(key)
+            if timer is not None and timer["due"] == due:
+                return due
+            heapq.heappop(self.heap)
+        return None
+
+    def take_due(self, now: float, limit: int) -> list[tuple[str, dict]]:
+        batch = []
+        while len(batch) < limit:
+            due = self.next_due()
+            if due is None or due > now:
+                break
+            _, key = heapq.heappop(self.heap)
+            batch.append((key, self.timers[key]))
+        return batch
+
+    def finish(self, key: str, timer: dict):
+        # Only remove it if it wasn't rescheduled while it ran
+        if self.timers.get(key) is timer:
+            del self.timers[key]
+            self.dirty.add(key)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        outbound_priority.set(PRIORITY_MODERATION)
+        semaphore = asyncio.Semaphore(TIMER_CONCURRENCY)
+        while True:
+            self.changed.clear()
+            due = self.next_due()
+            delay = None if due is None else due - time.time()
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self.take_due(time.time(), TIMER_BATCH_SIZE)
+            await asyncio.gather(*(self.run_timer(semaphore, key, timer) for key, timer in batch))
+
+    async def run_timer(self, semaphore: asyncio.Semaphore, key: str, timer: dict):
+        async with semaphore:
+            handler = TIMER_ACTIONS.get(timer["action"])
+            try:
+                if handler is not None:
+                    await handler(timer)
+            except Exception as e:
+                # A broken timer is dropped rather than retried forever or taking the scheduler down with it
+                logger.error(f"Timed action '{key}' failed: {e!r}")
+            finally:
+                self.finish(key, timer)
+
+
+timer_store = TimerStore(SQLiteTable(database, "timers", key="key") if database else JournaledJsonObjectFile(TIMER_FILE, TIMER_JOURNAL_FILE, indent=None))
+
+
+async def expire_ban(timer: dict):
+    guild = bot.get_guild(timer["guild_id"])
+    if guild is None:
+        return
+    try:
+        await guild.unban(discord.Object(id=timer["target_id"]), reason="Temporary ban expired")
+    except discord.NotFound:
+        return  # Already unbanned by hand
+
+    logger.info(f"Temporary ban of user {timer['target_id']} expired, they have been unbanned.")
+    embed = discord.Embed(
+        title="🔓 Temporary Ban Expired",
+        description=f"> <@{timer['target_id']}> (`{timer['target_id']}`) has been unbanned.",
+        color=colors["green"]
+    )
+    log_sink.send(embed)
+
+
+@bot.event
+async def on_member_unban(guild: discord.Guild, user: discord.User):
+    # Unbanned by hand (or by the timer itself), so a pending temp ban timer has nothing left to do
+    timer_store.cancel("unban", user.id)
+
+
+async def expire_mute(timer: dict):
+    guild = bot.get_guild(timer["guild_id"])
+    member = guild.get_member(timer["target_id"]) if guild is not None else None
+    if member is None:
+        return
+
+    # Discord ends the timeout by itself, this only makes sure and logs it
+    timed_out_until = member.communication_disabled_until
+    if timed_out_until is not None and timed_out_until > discord.utils.utcnow():
+        if abs(timed_out_until.timestamp() - timer["due"]) > 1:
+            # A moderator set a different timeout since, that one stays
+            logger.info(f"Mute timer of {member} ended, but they were timed out again until {timed_out_until}.")
+            return
+        await member.edit(communication_disabled_until=None, reason="Mute expired")
+
+    logger.info(f"Mute of {member} expired.")
+    embed = discord.Embed(
+        title="🔊 Mute Expired",
+        description=f"> **{member}** ({member.mention}) is no longer muted.",
+        color=colors["green"]
+    )
+    log_sink.send(embed)
+
+
+async def expire_afk(timer: dict):
+    user_id = str(timer["target_id"])
+    if user_id in afk_store:
+        afk_store.remove(user_id)
+        logger.info(f"AFK status of user {user_id} expired after {AFK_EXPIRE_HOURS} hours.")
+
+
+async def close_idle_ticket(timer: dict):
+    channel = bot.get_channel(timer["target_id"])
+    if channel is None:
+        return  # Already deleted
+
+    # Messages push the deadline back, the channel knows when its last one was sent
+    idle_seconds = MODMAIL_IDLE_HOURS * 3600
+    last_active = discord.utils.snowflake_time(channel.last_message_id).timestamp() if channel.last_message_id else 0
+    if last_active + idle_seconds > time.time():
+        timer_store.schedule("modmail_close", channel.id, last_active + idle_seconds)
+        return
+
+    outbound_priority.set(PRIORITY_MODMAIL)
+    modmail_store.set_status(channel.id, "resolved")
+    logger.info(f"ticket '{channel.name}' has been closed after {MODMAIL_IDLE_HOURS} hours without messages.")
+    start_ticket_close(channel, "Modmail thread closed for inactivity.")
+
+
+TIMER_ACTIONS = {
+    "unban": expire_ban,
+    "unmute": expire_mute,
+    "afk": expire_afk,
+    "modmail_close": close_idle_ticket,
+}
+
+
+def arm_timers():
+    # Runs from on_ready, once the bot can see its channels again
+    if timer_store.task is not None:
+        return
+
+    # Unmute buttons from before the restart work again
+    for timer in timer_store.pending("unmute"):
+        bot.add_view(UnmuteButton(timer["moderator_id"], timer["target_id"]))
 
-    # ======================================================================================================================================================================================
-    # The buttons for the ModMail Interactions
-    # Part One: "Closed"
+    # Tickets opened before there were timers
+    if MODMAIL_IDLE_HOURS:
+        for ticket in modmail_store.open_by_user.values():
+            if f"modmail_close:{ticket['channel_id']}" not in timer_store.timers and bot.get_channel(ticket["channel_id"]) is not None:
+                timer_store.schedule("modmail_close", ticket["channel_id"], time.time() + MODMAIL_IDLE_HOURS * 3600)
 
-    @discord.ui.button(label="Close", style=discord.ButtonStyle.danger)
-    async def close_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+    timer_store.start()
+    logger.info(f"Re-armed {len(timer_store.timers)} timed actions.")
 
-        # Check if the user has permission to use this button
-        if not is_staff(interaction.user, True, True, True):
-            await interaction.response.send_message("You don't have permission to close this thread.", ephemeral=True)
+# ======================================================================================================================================================================================
+# Image archiving
+# Every image is downloaded once and stored under the hash of its content (duplicates aren't written again).
+# The stored file is what gets uploaded to the image log channel. A few workers do this in the background
+# so on_message never waits.
+
+IMAGE_FOLDER = "logs/images"
+IMAGE_MAX_BYTES = config.get("IMAGE_MAX_BYTES", 25 * 1024 * 1024)  # Bigger images are skipped
+IMAGE_WORKERS = config.get("IMAGE_WORKERS", 4)  # Downloads running at the same time
+IMAGE_QUEUE_SIZE = config.get("IMAGE_QUEUE_SIZE", 100)  # Messages waiting to be archived before new ones are skipped
+IMAGE_CHUNK_SIZE = 64 * 1024
+IMAGE_MEMORY_BUFFER = 1024 * 1024  # Images smaller than this are hashed in memory and never written if already stored
+IMAGE_INDEX_FILE = os.path.join(IMAGE_FOLDER, "index.jsonl")
+IMAGE_STORAGE_BUDGET = config.get("IMAGE_STORAGE_BUDGET", 5 * 1024 ** 3)  # Bytes logs/images may use (0 = no limit)
+IMAGE_MAX_AGE_DAYS = config.get("IMAGE_MAX_AGE_DAYS", 0)  # Images unused for longer are deleted (0 = keep)
+
+
+class ImageStore:
+    """
+    Images saved under the SHA-256 of their content, so an image reposted 500 times is stored once.
+    Files are kept in least-recently-used order, and the oldest are evicted to stay under the budget.
+    """
+
+    def __init__(self, folder: str, budget: int, max_age_days: float):
+        self.folder = folder
+        self.budget = budget
+        self.max_age = max_age_days * 86400
+        self.files = collections.OrderedDict()  # file name -> (size, last used), least recently used first
+        self.total_bytes = 0
+        self.evicted = set()  # File names still listed in the index, dropped from it by the eviction loop
+
+        # Scanned once at startup, older randomly named images count towards the budget too
+        entries = []
+        for entry in os.scandir(folder):
+            if entry.is_file() and entry.path != IMAGE_INDEX_FILE and not entry.name.endswith(".part"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for last_used, name, size in sorted(entries):
+            self.files[name] = (size, last_used)
+            self.total_bytes += size
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.folder, name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def touch(self, name: str):
+        size, _ = self.files[name]
+        self.files[name] = (size, time.time())
+        self.files.move_to_end(name)
+
+    def add(self, name: str, size: int):
+        if name in self.files:
+            self.touch(name)
             return
+        self.files[name] = (size, time.time())
+        self.total_bytes += size
+        self.evicted.discard(name)
+
+    def take_evictions(self) -> list[str]:
+        # Picks the files to delete (oldest first) and forgets them; the caller deletes them off the loop
+        cutoff = time.time() - self.max_age
+        victims = []
+        while self.files:
+            name, (size, last_used) = next(iter(self.files.items()))
+            over_budget = self.budget and self.total_bytes > self.budget
+            too_old = self.max_age and last_used < cutoff
+            if not over_budget and not too_old:
+                break
+            self.files.popitem(last=False)
+            self.total_bytes -= size
+            self.evicted.add(name)
+            victims.append(self.path(name))
+        return victims
 
-        embed = discord.Embed(
-            title="🚫 Channel Deletion",
-            description="> This channel will be deleted in a few seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(
-            text="This message was written by server staff.",
-        )
 
-        # Load modmail logs
-        modmail_logs = load_modmail_logs()
-        user_id = None
-        channel = interaction.channel
+def remove_files(paths: list[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
-        for uid, data in modmail_logs.items():
-            if data["channel_id"] == channel.id:
-                user_id = uid
-                break
 
-        if user_id:
-            modmail_logs[user_id]["status"] = "resolved"
-            save_modmail_logs(modmail_logs)
-        await interaction.response.send_message(embed=embed)
+def compact_image_index(removed: set[str]):
+    # Rewrites the index without the lines for evicted files. Older lines have the file name under "sha256".
+    if not os.path.exists(IMAGE_INDEX_FILE):
+        return
+    temp_path = f"{IMAGE_INDEX_FILE}.tmp"
+    with open(IMAGE_INDEX_FILE, "r") as source, open(temp_path, "w") as target:
+        for line in source:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record.get("file", record.get("sha256")) not in removed:
+                target.write(line)
+    os.replace(temp_path, IMAGE_INDEX_FILE)
+
+
+image_store = ImageStore(IMAGE_FOLDER, IMAGE_STORAGE_BUDGET, IMAGE_MAX_AGE_DAYS)
+image_index_lock = asyncio.Lock()  # Appends and compaction of the index never overlap
+
+
+@tasks.loop(hours=1)
+async def image_eviction_loop():
+    victims = image_store.take_evictions()
+    if victims:
+        await asyncio.to_thread(remove_files, victims)
+        logger.info(f"Evicted {len(victims)} old images from {IMAGE_FOLDER}.")
+
+    # Evictions made while archiving are dropped from the index here too, so it's rewritten at most once an hour
+    if image_store.evicted:
+        removed = image_store.evicted
+        image_store.evicted = set()
+        async with image_index_lock:
+            await asyncio.to_thread(compact_image_index, removed)
+
+
+class ImageArchiver:
+    """A bounded pool of workers that archive the images posted in messages."""
+
+    def __init__(self, workers: int, max_queued: int, max_bytes: int):
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.tasks = []
+        self.session = None
+        self.dropped = 0
+        self.archived_bytes = 0
+
+    def submit(self, message: discord.Message):
+        images = [
+            attachment for attachment in message.attachments
+            if attachment.content_type and attachment.content_type.startswith("image/")
+        ]
+        if not images:
+            return
 
-        # Wait for 5 seconds
-        await asyncio.sleep(5)
+        # Only keep what's needed, not the whole message
+        job = {
+            "author": str(message.author),
+            "channel": str(message.channel),
+            "message_id": message.id,
+            "author_id": message.author.id,
+            "channel_id": message.channel.id,
+            "images": images,
+        }
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Image queue is full, skipped {len(images)} images from {message.author} (skipped {self.dropped} so far).")
+
+    def start(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        if self.session is None:
+            return
 
-        channel = interaction.channel
-        logger.info(f"ticket '{interaction.channel}' has been closed.")
-        await channel.delete(reason="Modmail thread closed.")
+        # Give queued images a moment to finish before shutting down
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=10)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopped the image archiver with {self.queue.qsize()} messages still queued.")
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.session.close()
+        self.session = None
+
+    async def worker(self):
+        outbound_priority.set(PRIORITY_LOG)
+        while True:
+            job = await self.queue.get()
+            try:
+                await self.archive(job)
+            except Exception as e:
+                logger.error(f"Failed to archive images from {job['author']}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def download(self, attachment: discord.Attachment) -> str | None:
+        # Streams the attachment while hashing it, and returns the name it's stored under in the image store
+        if attachment.size > self.max_bytes:
+            logger.info(f"Skipped image '{attachment.filename}' ({attachment.size} bytes), it's over the size limit.")
+            return None
+
+        temp_path = os.path.join(IMAGE_FOLDER, f"{attachment.id}.part")
+        digest = hashlib.sha256()
+        buffer = []
+        size = 0
+        file = None
+        try:
+            async with self.session.get(attachment.url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(IMAGE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError(f"image is over the {self.max_bytes} byte limit")
+                    digest.update(chunk)
+
+                    # Small images stay in memory, big ones spill over into a temp file
+                    if file is None:
+                        buffer.append(chunk)
+                        if size > IMAGE_MEMORY_BUFFER:
+                            file = await asyncio.to_thread(open, temp_path, "wb")
+                            await asyncio.to_thread(file.writelines, buffer)
+                            buffer = []
+                    else:
+                        await asyncio.to_thread(file.write, chunk)
+
+            name = f"{digest.hexdigest()}{os.path.splitext(attachment.filename)[1].lower()}"
+            if name in image_store:
+                # Already stored, just mark it as recently used
+                image_store.touch(name)
+                await asyncio.to_thread(os.utime, image_store.path(name))
+                return name
+
+            if file is None:
+                file = await asyncio.to_thread(open, temp_path, "wb")
+                await asyncio.to_thread(file.writelines, buffer)
+            await asyncio.to_thread(file.close)
+            file = None
+            await asyncio.to_thread(os.replace, temp_path, image_store.path(name))
+            image_store.add(name, size)
+            self.archived_bytes += size
+            return name
+
+        except (aiohttp.ClientError, OSError, ValueError) as e:
+            logger.error(f"Failed to download image '{attachment.filename}': {e}")
+            return None
+
+        finally:
+            if file is not None:
+                await asyncio.to_thread(file.close)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    async def archive(self, job: dict):
+        saved = []
+        index_lines = []
+        for attachment in job["images"]:
+            name = await self.download(attachment)
+            if name is None:
+                continue
+
+            saved.append((image_store.path(name), attachment.filename, attachment.size))
+            index_lines.append(json.dumps({
+                "sha256": os.path.splitext(name)[0],
+                "file": name,
+                "filename": attachment.filename,
+                "message_id": job["message_id"],
+                "author_id": job["author_id"],
+                "channel_id": job["channel_id"],
+                "date": str(datetime.datetime.now(datetime.UTC)),
+            }) + "\n")
+            logger.info(f"Image from {job['author']} saved: {image_store.path(name)}")
+
+        if not saved:
+            return
 
+        # Remember which message each image came from
+        async with image_index_lock:
+            await asyncio.to_thread(append_lines, IMAGE_INDEX_FILE, index_lines)
+
+        # Stay under the storage budget
+        victims = image_store.take_evictions()
+        if victims:
+            await asyncio.to_thread(remove_files, victims)
+
+        # Reupload the saved files in as few messages as Discord's file count and upload size limits allow
+        if image_log_channel is not None:
+            for batch in self.upload_batches(saved, image_log_channel.guild.filesize_limit):
+                try:
+                    await image_log_channel.send(
+                        content=f"**Image from {job['author']} in {job['channel']}:**",
+                        files=[discord.File(path, filename=filename) for path, filename in batch if os.path.exists(path)]
+                    )
+                except OutboundShed:
+                    logger.warning(f"Skipped reposting images from {job['author']}, the bot is busy (they're still saved).")
+                    break
+                except discord.HTTPException as e:
+                    logger.error(f"Failed to repost {len(batch)} images from {job['author']} (they're still saved): {e}")
+
+    @staticmethod
+    def upload_batches(saved: list, size_limit: int) -> list[list]:
+        batches = []
+        batch_size = 0
+        for path, filename, size in saved:
+            if size > size_limit:
+                logger.info(f"Not reposting image '{filename}' ({size} bytes), it's over the upload limit (it's still saved).")
+                continue
+            if not batches or len(batches[-1]) >= 10 or batch_size + size > size_limit:
+                batches.append([])
+                batch_size = 0
+            batches[-1].append((path, filename))
+            batch_size += size
+        return batches
+
+
+def append_lines(path: str, lines: list[str]):
+    with open(path, "a") as file:
+        file.writelines(lines)
+
+
+image_archiver = ImageArchiver(IMAGE_WORKERS, IMAGE_QUEUE_SIZE, IMAGE_MAX_BYTES)
 
 # ======================================================================================================================================================================================
-# Configure logging for all bot actions and messages
+# Word and link filter
+# All banned words and links are compiled into one Aho-Corasick automaton, so a message is scanned once
+# no matter how many patterns there are. Text is normalized first (case, leetspeak, zero-width characters)
+# so "B4dW\u200bord" still matches "badword". Words only match on their own, links match anywhere. The
+# pattern file is checked for changes every FILTER_RELOAD_INTERVAL seconds and reloaded without a restart.
 
-# Ensure the logs directory exists
-LOG_FOLDER = "logs"
+FILTER_FILE = config.get("FILTER_FILE", "assets/filter.json")
+FILTER_RELOAD_INTERVAL = config.get("FILTER_RELOAD_INTERVAL", 30)  # Seconds between checks for changes to FILTER_FILE
 
-logger = logging.getLogger(__name__)
+FILTER_NORMALIZE = str.maketrans({
+    "0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s",
+    "\u00ad": None, "\u200b": None, "\u200c": None, "\u200d": None, "\u2060": None, "\ufeff": None,
+})
 
-os.makedirs(LOG_FOLDER, exist_ok=True)
 
-if os.path.exists("assets/colors.json"):
-    with open("assets/colors.json", "r") as file:
-        colors = json.load(file)
-else:
-    logger.warning('The file "assets/colors.json" is missing. Please download it.')
+def normalize_filter_text(text: str) -> str:
+    return text.casefold().translate(FILTER_NORMALIZE)
 
-os.makedirs("logs/images", exist_ok=True)
 
-log_file_path = os.path.join(LOG_FOLDER, "logs.txt")
+class WordFilter:
+    """A single-pass matcher for banned words and links, reloaded when its file changes."""
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler(log_file_path, encoding="utf-8"),
-        logging.StreamHandler(),
-    ],
-)
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = None
+        self.exempt_channels = frozenset()
+        self.goto = [{}]  # One dict of next states per state
+        self.fail = [0]
+        self.output = [()]  # (pattern, length, whole_word) ending at each state
+        self.patterns = 0
 
-logger.info("\n")
-logger.info("=" * 50)
-logger.info("BOT STARTED")
-logger.info("=" * 50)
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self.mtime:
+            return
 
-# ======================================================================================================================================================================================
-# Configure modmail logging
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to load the word filter from {self.path}, keeping the old one: {e}")
+            return
 
-# Ensure the modmail JSON file exists
-MODMAIL_LOG_FILE = "logs/modmail_logs.json"
+        self.mtime = mtime
+        self.build(
+            [(word, True) for word in data.get("words", [])] + [(link, False) for link in data.get("links", [])]
+        )
+        self.exempt_channels = frozenset(data.get("exempt_channels", []))
+        logger.info(f"Loaded {self.patterns} word filter patterns from {self.path}.")
+
+    def build(self, patterns: list[tuple[str, bool]]):
+        goto = [{}]
+        output = [[]]
+        count = 0
+        for pattern, whole_word in patterns:
+            pattern = normalize_filter_text(pattern.strip())
+            if not pattern:
+                continue
+            state = 0
+            for character in pattern:
+                next_state = goto[state].get(character)
+                if next_state is None:
+                    next_state = goto[state][character] = len(goto)
+                    goto.append({})
+                    output.append([])
+                state = next_state
+            output[state].append((pattern, len(pattern), whole_word))
+            count += 1
+
+        # Breadth first, so every state's failure link points at an already finished state
+        fail = [0] * len(goto)
+        pending = collections.deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for character, next_state in goto[state].items():
+                pending.append(next_state)
+                fallback = fail[state]
+                while fallback and character not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[next_state] = goto[fallback].get(character, 0)
+                output[next_state] += output[fail[next_state]]
+
+        # Swap everything in at once, so a message never sees half a filter
+        self.goto, self.fail, self.output = goto, fail, [tuple(matches) for matches in output]
+        self.patterns = count
+
+    def find(self, content: str, channel_id: int):
+        # Returns the first banned pattern in the content, or None
+        if not content or channel_id in self.exempt_channels or self.patterns == 0:
+            return None
+
+        text = normalize_filter_text(content)
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, character in enumerate(text):
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+
+            for pattern, length, whole_word in output[state]:
+                if not whole_word:
+                    return pattern
+                start = index - length + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (index + 1 == len(text) or not text[index + 1].isalnum()):
+                    return pattern
+        return None
+
+
+word_filter = WordFilter(FILTER_FILE)
+word_filter.reload_if_changed()
+
+
+@tasks.loop(seconds=FILTER_RELOAD_INTERVAL)
+async def filter_reload_loop():
+    word_filter.reload_if_changed()
+
+
+async def enforce_filter(channel, message_id: int, author, content: str) -> bool:
+    # Deletes the message if it has a banned word or link, staff are never filtered
+    pattern = word_filter.find(content, channel.id)
+    if pattern is None or not isinstance(author, discord.Member) or has_staff_level(author, MOD_LEVEL):
+        return False
+
+    outbound_priority.set(PRIORITY_MODERATION)
+    try:
+        await channel.get_partial_message(message_id).delete()
+    except discord.HTTPException as e:
+        logger.error(f"Failed to delete a filtered message from {author} in #{channel}: {e}")
+        return False
 
-if not os.path.exists(MODMAIL_LOG_FILE):
-    with open(MODMAIL_LOG_FILE, "w") as file:
-        json.dump({}, file, indent=4)
+    logger.info(f"Deleted a message from {author} in #{channel} for containing '{pattern}'.")
+
+    embed = discord.Embed(
+        title="🚫 Message Removed",
+        description="> Your message contained a word or link that isn't allowed here.",
+        color=colors["red"]
+    )
+    embed.set_footer(text="This message was written by server staff.")
+    await channel.send(f"### {author.mention}", embed=embed, delete_after=5)
 
+    embed = discord.Embed(
+        title=f"Filtered message from {author} in {channel}",
+        description=f"> **Matched:** `{pattern}`\n> \n> {content}",
+        color=colors["red"]
+    )
+    log_sink.send(embed)
+    return True
 
-def load_modmail_logs():
-    if not os.path.exists("logs/modmail_logs.json"):
-        with open("logs/modmail_logs.json", "w") as file:
-            json.dump({}, file, indent=4)
-    with open("logs/modmail_logs.json", "r") as file:
-        return json.load(file)
+# ======================================================================================================================================================================================
+# Spam detection
+# Each active member gets a small record with their last few message times, content hashes and mention
+# counts. All of them are fixed-size, so checking a message is a handful of comparisons. Members who go
+# quiet are forgotten, and only SPAM_TRACKED_USERS are remembered at once.
+
+SPAM_WINDOW = config.get("SPAM_WINDOW", 8)  # Seconds looked at for message and mention floods
+SPAM_MESSAGE_LIMIT = config.get("SPAM_MESSAGE_LIMIT", 6)  # Messages allowed within SPAM_WINDOW
+SPAM_MENTION_LIMIT = config.get("SPAM_MENTION_LIMIT", 10)  # Mentions allowed within SPAM_WINDOW
+SPAM_DUPLICATE_WINDOW = config.get("SPAM_DUPLICATE_WINDOW", 60)  # Seconds looked at for repeated messages
+SPAM_DUPLICATE_LIMIT = config.get("SPAM_DUPLICATE_LIMIT", 3)  # Same message allowed this many times within the window
+SPAM_CHANNEL_LIMIT = config.get("SPAM_CHANNEL_LIMIT", 3)  # Same message allowed in this many channels within the window
+SPAM_MUTE_MINUTES = config.get("SPAM_MUTE_MINUTES", 10)  # Timeout given for spamming (0 = only delete and log)
+SPAM_TRACKED_USERS = config.get("SPAM_TRACKED_USERS", 10000)  # Members remembered at once
+SPAM_IDLE_SECONDS = config.get("SPAM_IDLE_SECONDS", 300)  # Members quiet for this long are forgotten
+
+
+class SpamRecord:
+    __slots__ = ("last_seen", "times", "contents", "mentions", "mention_total")
+
+    def __init__(self):
+        self.last_seen = 0.0
+        self.times = collections.deque(maxlen=SPAM_MESSAGE_LIMIT + 1)  # One more than allowed, so a full deque means over the limit
+        self.contents = collections.deque(maxlen=max(SPAM_DUPLICATE_LIMIT, SPAM_CHANNEL_LIMIT) * 2)  # (time, hash, channel_id)
+        self.mentions = collections.deque()  # (time, count)
+        self.mention_total = 0
+
+
+class SpamDetector:
+    """Catches message floods, repeated messages, cross-channel floods and mass mentions per member."""
+
+    def __init__(self, max_users: int, idle_seconds: float):
+        self.records = collections.OrderedDict()  # Least recently active first
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.caught = 0
+
+    def check(self, message: discord.Message):
+        # Returns why the message counts as spam, or None
+        now = time.monotonic()
+        user_id = message.author.id
+
+        record = self.records.get(user_id)
+        if record is None:
+            record = self.records[user_id] = SpamRecord()
+        else:
+            self.records.move_to_end(user_id)
+        record.last_seen = now
 
+        # Forget members who went quiet, or the least active ones if there are too many
+        while self.records:
+            oldest_id, oldest = next(iter(self.records.items()))
+            if len(self.records) <= self.max_users and now - oldest.last_seen <= self.idle_seconds:
+                break
+            del self.records[oldest_id]
+
+        record.times.append(now)
+        if len(record.times) == record.times.maxlen and now - record.times[0] <= SPAM_WINDOW:
+            return self.caught_spam(user_id, f"Sent {len(record.times)} messages in under {SPAM_WINDOW} seconds")
+
+        mentions = len(message.raw_mentions) + len(message.raw_role_mentions) + (1 if message.mention_everyone else 0)
+        while record.mentions and now - record.mentions[0][0] > SPAM_WINDOW:
+            record.mention_total -= record.mentions.popleft()[1]
+        if mentions:
+            record.mentions.append((now, mentions))
+            record.mention_total += mentions
+            if record.mention_total > SPAM_MENTION_LIMIT:
+                return self.caught_spam(user_id, f"Mentioned {record.mention_total} users or roles in under {SPAM_WINDOW} seconds")
+
+        if message.content:
+            content_hash = hash(" ".join(message.content.lower().split()))
+            copies = 1
+            channels = {message.channel.id}
+            for sent, previous_hash, channel_id in record.contents:
+                if previous_hash == content_hash and now - sent <= SPAM_DUPLICATE_WINDOW:
+                    copies += 1
+                    channels.add(channel_id)
+            record.contents.append((now, content_hash, message.channel.id))
+
+            if len(channels) > SPAM_CHANNEL_LIMIT and len(channels) > 1:
+                return self.caught_spam(user_id, f"Posted the same message in {len(channels)} channels")
+            if copies > SPAM_DUPLICATE_LIMIT:
+                return self.caught_spam(user_id, f"Repeated the same message {copies} times")
+        return None
+
+    def caught_spam(self, user_id: int, reason: str) -> str:
+        # Start over so the rest of the burst doesn't punish them again
+        self.records.pop(user_id, None)
+        self.caught += 1
+        return reason
+
+
+spam_detector = SpamDetector(SPAM_TRACKED_USERS, SPAM_IDLE_SECONDS)
+
+
+async def punish_spam(message: discord.Message, reason: str):
+    outbound_priority.set(PRIORITY_MODERATION)
+    member = message.author
+    logger.info(f"Spam detected from {member} in #{message.channel}: {reason}.")
 
-# Save modmail logs to JSON file
-def save_modmail_logs(modmail_logs):
-    with open("logs/modmail_logs.json", "w") as file:
-        json.dump(modmail_logs, file, indent=4)
+    try:
+        await message.delete()
+    except discord.HTTPException:
+        pass
 
+    muted = False
+    if SPAM_MUTE_MINUTES:
+        try:
+            await apply_mute(member, SPAM_MUTE_MINUTES * 60, f"Spam: {reason}", f"{SPAM_MUTE_MINUTES}m", bot.user)
+            muted = True
+        except discord.HTTPException as e:
+            logger.error(f"Failed to mute {member} for spamming: {e}")
+    else:
+        warn_ledger.add(str(member.id), {
+            "warned_by": str(bot.user),
+            "warned_by_id": bot.user.id,
+            "reason": f"[SPAM] {reason}",
+            "date": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M:%S")
+        })
 
-# Load active modmail from JSON
-active_modmail = load_modmail_logs()
+    embed = discord.Embed(
+        title="🔇 Spam Detected" if not muted else "🔇 User Muted for Spam",
+        description=f"> **{member}** ({member.mention})\n> \n> **Channel:** {message.channel.mention}\n> **Reason:** {reason}",
+        color=colors["orange"]
+    )
+    if muted:
+        embed.set_footer(text=f"Muted for {SPAM_MUTE_MINUTES} minutes.")
+    log_sink.send(embed)
 
 # ======================================================================================================================================================================================
 # Bot event for messages
@@ -308,8 +2591,31 @@ async def on_message(message):
     if message.author.bot:
         return
 
+    # AFK notices and such are less important than moderation, modmail sets its own priority below
+    outbound_priority.set(PRIORITY_NOTICE)
+
     logger.info(f"Message from {message.author} in #{message.channel}: '{message.content}'")
 
+    # Remember guild messages so deletes and edits can be logged after the library forgets them
+    if message.guild is not None:
+        message_cache.add(message)
+
+    # Banned words and links, nothing else needs to happen once it's deleted
+    if message.guild is not None and await enforce_filter(message.channel, message.id, message.author, message.content):
+        return
+
+    # Spam is dealt with in the background, staff are never punished
+    if message.guild is not None:
+        spam_reason = spam_detector.check(message)
+        if spam_reason is not None and not has_staff_level(message.author, MOD_LEVEL):
+            run_in_background(punish_spam(message, spam_reason), f"spam punishment for {message.author.id}")
+
+    # Staff messages in an open ticket are sent on to the user's DMs
+    if message.guild is not None and message.webhook_id is None:
+        _, ticket = modmail_store.find_by_channel(message.channel.id)
+        if ticket is not None and ticket["status"] == "open" and message.author.id != ticket["user_id"]:
+            modmail_relay.forward("user", message.channel.id, message)
+
     # Ensure the log channels exist in the bot's known channels
     if text_log_channel:
         # Log text-based messages in test-logs channel and Logs file
@@ -320,56 +2626,36 @@ async def on_message(message):
                 color=colors["green"]
             )
 
-            # Send embed in text-logs channel
-            await text_log_channel.send(embed=embed)
+            # Queue embed for the text-logs channel
+            log_sink.send(embed)
 
 # ======================================================================================================================================================================================
 # Bot event for messages
 # Part Two: Image-Logs Channel and Image Log Folder
 
-    # Ensure the images directory exists
-    image_folder = "logs/images"
-    os.makedirs(image_folder, exist_ok=True)  # Creates the folder if it doesn't exist
-
-    # Log messages with images in channel and sends a message to the Logs file
+    # Hand images to the archiver, it downloads and reposts them in the background
     if message.attachments:
-        for attachment in message.attachments:
-            if attachment.content_type and attachment.content_type.startswith("image/"):
-                if image_log_channel is not None:
-                    await image_log_channel.send(
-                        content=f"**Image from {message.author} in {message.channel}:**",
-                        file=await attachment.to_file()
-                    )
-                # Generate a scrambled 20-letter name
-                scrambled_name = ''.join(random.choices(string.ascii_letters, k=20))
-
-                # Construct the new filename
-                original_filename = attachment.filename
-                scrambled_filename = f"{scrambled_name} - {original_filename}"
-                image_path = os.path.join(image_folder, scrambled_filename)  # Use os.path.join for cross-platform compatibility
-
-                # Save the file with the new filename
-                await attachment.save(image_path)
-                logger.info(f"Image from {message.author} saved: {image_path}")
+        image_archiver.submit(message)
 
 # ======================================================================================================================================================================================
 # Checks for AFK
 
-    if str(message.author.id) in afk_users and not message.content.startswith("!afk"):
-        del afk_users[str(message.author.id)]
-        with open(AFK_FILE, "w") as f:
-            json.dump(afk_users, f)
+    if str(message.author.id) in afk_store and not message.content.startswith("!afk"):
+        afk_store.remove(str(message.author.id))
+        timer_store.cancel("afk", message.author.id)
         embed = discord.Embed(title="Welcome Back", description=f"You are no longer AFK!",
                               color=colors["green"])
         view = DoneButton(message.author.id)
         logger.info(f"{message.author.name} returned from being AFK.")
         await message.channel.send(f"### {message.author.mention}", embed=embed, view=view)
-    elif str(message.author.id) in afk_users and message.content.startswith("!afk"):
+    elif str(message.author.id) in afk_store and message.content.startswith("!afk"):
         logger.info(f"{message.author.name} tried to trigger 'AFK' while AFK")
 
     for mention in message.mentions:
-        if str(mention.id) in afk_users:
-            afk_info = afk_users[str(mention.id)]
+        afk_info = afk_store.get(str(mention.id))
+
+        # Only one notice per AFK user per channel every so often, so mention spam doesn't make the bot spam too
+        if afk_info is not None and not afk_notice_limiter.hit((message.channel.id, mention.id)):
             afk_time = int(time.time() - afk_info["time"])
             embed = discord.Embed(title="AFK Notice", description=f"{mention.display_name} is currently AFK.",
                                   color=colors["orange"])
@@ -386,71 +2672,63 @@ async def on_message(message):
     # Check if it's a DM and not from a bot
     if message.guild is None and not message.author.bot:
         if message.content.strip().lower() == "contact":
-            # Load current modmail data
-            modmail_logs = load_modmail_logs()
+            outbound_priority.set(PRIORITY_MODMAIL)
+            if contact_limiter.hit(message.author.id):
+                logger.info(f"{message.author.name} (@{message.author.id}) tried to reach modmail again too quickly.")
+                return
+
             guild = bot.get_guild(GUILD_ID)
 
             if guild is None:
                 await message.author.send("Could not retrieve the server. Please contact the server administrators.")
                 return
 
-            # Fetch the category
-            category = discord.utils.get(guild.categories, id=MODMAIL_CATEGORY_ID)
-            if category is None:
+            # Make sure the category exists
+            if MODMAIL_CATEGORY_ID not in modmail_categories:
                 await message.author.send("Modmail category is not configured properly. Please contact the server administrators.")
                 return
 
-            # Check if user already has an open modmail
-            if str(message.author.id) in modmail_logs and modmail_logs[str(message.author.id)]["status"] == "open":
-                existing_channel_id = modmail_logs[str(message.author.id)]["channel_id"]
-                existing_channel = guild.get_channel(existing_channel_id)
-
-                if existing_channel:
-                    embed = discord.Embed(
-                        title="🚫 Modmail Already Open!",
-                        description=f"> You already have an active modmail open.\n> \n> {existing_channel.mention}",
-                        color=colors["red"]
-                    )
-                    embed.set_footer(text="If you believe this is a mistake, contact the staff directly.")
-                    await message.author.send(f"### {message.author.mention} ModMail Error!", embed=embed)
-                    logger.info(f"{message.author.name} (@{message.author.id}) attempted to reach modmail, ticket already exists: '{message.author.name}'")
-                    return
-
-            overwrites = {
-                guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                message.author: discord.PermissionOverwrite(read_messages=True, send_messages=True),
-            }
-
-            for role_id in MOD_ROLE_ID:
-                role = guild.get_role(role_id)
-                if role:
-                    overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
-
-            # Add permissions for allowed roles
-            for role_id in MOD_ROLE_ID:
-                role = guild.get_role(role_id)
-                if role:
-                    overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
-
-            # Create the channel
-            channel_name = f"{message.author.name}"
-            channel = await guild.create_text_channel(
-                name=channel_name,
-                category=category,
-                overwrites=overwrites,
-                topic=f"Modmail thread for {message.author}",
-                reason="Modmail channel creation"
-            )
-
-            embed = discord.Embed(
-                title="📃 Modmail Thread",
-                description=f"> Modmail initiated by {message.author.mention}. \n> \n> Please describe your issue and how we can assist you.",
-                color=colors["blue"]
-            )
-            embed.set_footer(text="Use the buttons below to manage this thread.")
+            # Check if user already has an open modmail, or one that's being created right now
+            existing_channel = None
+            creating = modmail_creations.get(message.author.id)
+            if creating is not None:
+                try:
+                    existing_channel = await asyncio.shield(creating)
+                except discord.HTTPException:
+                    pass  # It failed, try again below
+            else:
+                open_ticket = modmail_store.get_open(str(message.author.id))
+                if open_ticket is not None:
+                    existing_channel = guild.get_channel(open_ticket["channel_id"])
+
+            if existing_channel:
+                embed = discord.Embed(
+                    title="🚫 Modmail Already Open!",
+                    description=f"> You already have an active modmail open.\n> \n> {existing_channel.mention}",
+                    color=colors["red"]
+                )
+                embed.set_footer(text="If you believe this is a mistake, contact the staff directly.")
+                await message.author.send(f"### {message.author.mention} ModMail Error!", embed=embed)
+                logger.info(f"{message.author.name} (@{message.author.id}) attempted to reach modmail, ticket already exists: '{message.author.name}'")
+                return
 
-            view = ModmailView(guild=guild, allowed_roles=[MOD_ROLE_ID, ADMIN_ROLE_ID, SERVICER_ROLE_ID])
-            await channel.send(f"### {MOD_ROLE_MENTION} Come help!", embed=embed, view=view)
+            # Registered before the first await, so a second "contact" waits for this one
+            creating = modmail_creations[message.author.id] = asyncio.create_task(create_modmail_ticket(guild, message.author))
+            try:
+                channel = await creating
+            finally:
+                modmail_creations.pop(message.author.id, None)
+
+            if channel is None:
+                embed = discord.Embed(
+                    title="🚫 Modmail Is Full!",
+                    description="> There are too many open modmail tickets right now.\n> \n> Please try again later.",
+                    color=colors["red"]
+                )
+                embed.set_footer(text="This message was written by server staff.")
+                await message.author.send(f"### {message.author.mention} ModMail Error!", embed=embed)
+                logger.warning(f"{message.author.name} (@{message.author.id}) could not create a ticket, every modmail category is full.")
+                return
 
             # Notify the user
             embed = discord.Embed(
@@ -462,19 +2740,22 @@ async def on_message(message):
             await message.author.send(f"### {message.author.mention} Thank you for reaching out!", embed=embed)
             logger.info(f"{message.author.name} (@{message.author.id}) created a ticket: '{message.author.name}'")
 
-            modmail_logs[str(message.author.id)] = {
-                "user": message.author.name,
-                "user_id": message.author.id,
-                "channel_id": channel.id,
-                "status": "open",
-                "date": str(datetime.datetime.now(datetime.UTC))
-            }
+        # ======================================================================================================================================================================================
+        # Bot event for messages
+        # Part Four: Anything else from a user with an open ticket goes to the ticket channel
 
-            save_modmail_logs(modmail_logs)
+        elif (open_ticket := modmail_store.get_open(str(message.author.id))) is not None:
+            if modmail_relay_limiter.hit(message.author.id):
+                logger.info(f"Did not relay a DM from {message.author} to their ticket, they're sending too many.")
+                return
+            modmail_relay.forward("ticket", open_ticket["channel_id"], message)
 
         # ======================================================================================================================================================================================
         # Bot event for messages
-        # Part Four: If DM'd the word "Help"
+        # Part Five: If DM'd the word "Help"
+
+        elif dm_reply_limiter.hit(message.author.id):
+            return
 
         elif message.content.strip().lower() == "help":
 
@@ -490,7 +2771,7 @@ async def on_message(message):
 
         # ======================================================================================================================================================================================
         # Bot event for messages
-        # Part Five: If DM'd anything other than those words
+        # Part Six: If DM'd anything other than those words
 
         else:
 
@@ -508,49 +2789,346 @@ async def on_message(message):
 
 
 # ======================================================================================================================================================================================
-# Bot Event for member joins:
-# Part One: DM the Member
-
-@bot.event
-async def on_member_join(member: discord.Member):
-    rules_channel = bot.get_channel(RULES_CHANNEL_ID)
+# Welcome batching
+# During a raid or a big invite wave, one welcome embed and one DM per member floods the welcome channel
+# and uses up the REST budget. Above the join-rate threshold, new members are welcomed together in one
+# summary message per interval, and welcome DMs wait in a small queue that is paused until things calm down.
+
+WELCOME_RAID_THRESHOLD = config.get("WELCOME_RAID_THRESHOLD", 10)  # Joins per minute before welcomes are batched
+WELCOME_BATCH_INTERVAL = config.get("WELCOME_BATCH_INTERVAL", 30)  # Seconds between summary welcomes while batching
+WELCOME_DM_WORKERS = config.get("WELCOME_DM_WORKERS", 2)  # Welcome DMs sent at the same time
+WELCOME_DM_QUEUE_SIZE = config.get("WELCOME_DM_QUEUE_SIZE", 200)  # Welcome DMs waiting before new ones are skipped
+
+
+class WelcomeBatcher:
+    """Welcomes members one by one, or in summaries while many join at once."""
+
+    WINDOW = 60  # Seconds of joins counted for the join rate
+    MAX_CONTENT = 2000  # Discord's limit for message content
+
+    def __init__(self, threshold: int, interval: float, workers: int, max_queued: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.workers = workers
+        self.joins = collections.deque()
+        self.pending = []
+        self.batching = False
+        self.summary_task = None
+        self.dm_queue = asyncio.Queue(maxsize=max_queued)
+        self.dm_allowed = asyncio.Event()
+        self.dm_allowed.set()
+        self.tasks = []
+        self.skipped_dms = 0
+
+    def join_rate(self) -> int:
+        now = time.monotonic()
+        while self.joins and now - self.joins[0] > self.WINDOW:
+            self.joins.popleft()
+        return len(self.joins)
+
+    def record_join(self) -> bool:
+        # Returns True while members are joining too fast to welcome one by one
+        self.joins.append(time.monotonic())
+        if not self.batching and self.join_rate() > self.threshold:
+            self.batching = True
+            self.dm_allowed.clear()
+            logger.warning(f"{len(self.joins)} members joined in the last minute, batching welcomes and pausing welcome DMs.")
+        return self.batching
+
+    def add(self, member: discord.Member):
+        self.pending.append(member)
+        if self.summary_task is None:
+            self.summary_task = asyncio.create_task(self.run_summaries())
+
+    def queue_dm(self, member: discord.Member, embed: discord.Embed):
+        try:
+            self.dm_queue.put_nowait((member, embed))
+        except asyncio.QueueFull:
+            self.skipped_dms += 1
+            if self.skipped_dms % 50 == 1:
+                logger.warning(f"Welcome DM queue is full, skipped {self.skipped_dms} welcome DMs so far.")
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.dm_worker()) for _ in range(self.workers)]
+
+    async def dm_worker(self):
+        outbound_priority.set(PRIORITY_NOTICE)
+        while True:
+            member, embed = await self.dm_queue.get()
+            try:
+                await self.dm_allowed.wait()
+                await member.send(embed=embed)
+            except discord.HTTPException:
+                print(f"Could not send a DM to {member.name}. They may have DMs disabled.")
+            finally:
+                self.dm_queue.task_done()
+
+    async def run_summaries(self):
+        outbound_priority.set(PRIORITY_NOTICE)
+        while self.batching:
+            await asyncio.sleep(self.interval)
+            await self.send_summary()
+
+            if self.join_rate() <= self.threshold:
+                self.batching = False
+                self.dm_allowed.set()
+                logger.info(f"Join rate is back to normal, welcoming members one by one again ({self.dm_queue.qsize()} welcome DMs queued).")
+        self.summary_task = None
+
+    def pack_mentions(self, members: list[discord.Member]) -> list[str]:
+        # As many mentions as fit into each message
+        messages = []
+        current = ""
+        for member in members:
+            if current and len(current) + 1 + len(member.mention) > self.MAX_CONTENT:
+                messages.append(current)
+                current = ""
+            current = f"{current} {member.mention}" if current else member.mention
+        if current:
+            messages.append(current)
+        return messages
+
+    async def send_summary(self):
+        members, self.pending = self.pending, []
+        welcome_channel = bot.get_channel(WELCOME_CHANNEL_ID)
+        if not members or welcome_channel is None:
+            return
 
-    try:
+        guild = members[0].guild
         embed = discord.Embed(
-            title="🎉 Welcome!",
-            description=f"> Thank you for joining {member.guild.name}!\n> We're happy to get the chance to chat with you!\n> \n> - Make sure to check out the **Rules**\n> \n> - Chat and Enjoy our wonderful server",
+            title="🎉 Welcome to the Server!",
+            description=(
+                f"> Welcome to our **{len(members)}** new members, we're so excited to have you all in **{guild.name}**!\n> \n"
+                f"> Please remember to read the **Rules**."
+            ),
             color=colors["gold"]
         )
         embed.set_footer(
-            text="This message was written by server staff.",
+            text=f"Member #{len(guild.members)}",
         )
 
-        await member.send(embed=embed)
-    except discord.Forbidden:
-        print(f"Could not send a DM to {member.name}. They may have DMs disabled.")
+        for index, content in enumerate(self.pack_mentions(members)):
+            try:
+                await welcome_channel.send(content, embed=embed if index == 0 else None)
+            except discord.HTTPException as e:
+                logger.error(f"Failed to send the welcome summary for {len(members)} members: {e}")
+                break
 
-    # ======================================================================================================================================================================================
-    # Bot Event for member joins:
-    # Part Two: Send to Welcome Channel
 
-    # Define the channel to send the message
-    welcome_channel = bot.get_channel(WELCOME_CHANNEL_ID)
-    # Create the embed
+welcome_batcher = WelcomeBatcher(WELCOME_RAID_THRESHOLD, WELCOME_BATCH_INTERVAL, WELCOME_DM_WORKERS, WELCOME_DM_QUEUE_SIZE)
+
+# ======================================================================================================================================================================================
+# Raid detection
+# Every join goes into a ring buffer covering the last RAID_WINDOW seconds. Running counters track how
+# many of those accounts were created in the same hour and how many share a username once digits and
+# symbols are removed. Each join updates the counters and drops expired joins, so the work per join stays
+# constant no matter how fast people arrive. When a threshold trips, the text log gets an alert, the server
+# verification level is raised, and the flagged members can be timed out or kicked by a small worker pool.
+
+RAID_WINDOW = config.get("RAID_WINDOW", 60)  # Seconds of joins looked at
+RAID_BUFFER_SIZE = config.get("RAID_BUFFER_SIZE", 5000)  # Joins remembered at most, however short the window
+RAID_JOIN_THRESHOLD = config.get("RAID_JOIN_THRESHOLD", 20)  # Joins within the window that count as a raid
+RAID_CLUSTER_THRESHOLD = config.get("RAID_CLUSTER_THRESHOLD", 8)  # Joined accounts created in the same hour
+RAID_NAME_THRESHOLD = config.get("RAID_NAME_THRESHOLD", 5)  # Joined accounts with the same name apart from digits and symbols
+RAID_COOLDOWN = config.get("RAID_COOLDOWN", 300)  # Seconds without suspicious joins before a raid is over
+RAID_VERIFICATION_LEVEL = config.get("RAID_VERIFICATION_LEVEL", "high")  # Verification level during a raid (null = don't change)
+RAID_ACTION = config.get("RAID_ACTION", "none").lower()  # What to do to flagged members: none, timeout or kick
+RAID_TIMEOUT_MINUTES = config.get("RAID_TIMEOUT_MINUTES", 60)  # Timeout length when RAID_ACTION is timeout
+RAID_ACTION_WORKERS = config.get("RAID_ACTION_WORKERS", 3)  # Timeouts or kicks running at the same time
+
+
+class RaidDetector:
+    """Flags join floods, clusters of freshly made accounts and look-alike usernames."""
+
+    def __init__(self, window: float, buffer_size: int, join_threshold: int, cluster_threshold: int, name_threshold: int, cooldown: float):
+        self.window = window
+        self.buffer_size = buffer_size
+        self.join_threshold = join_threshold
+        self.cluster_threshold = cluster_threshold
+        self.name_threshold = name_threshold
+        self.cooldown = cooldown
+        self.joins = collections.deque()  # (joined, member_id, created_hour, name_key), oldest first
+        self.created_counts = collections.Counter()
+        self.name_counts = collections.Counter()
+        self.raid_until = 0.0
+        self.flagged = set()
+        self.actions = asyncio.Queue(maxsize=buffer_size)
+        self.tasks = []
+        self.raids = 0
+
+    @staticmethod
+    def name_key(name: str):
+        # "raider_0123" and "Raider.88" both become "raider"
+        key = "".join(character for character in name.lower() if character.isalpha())
+        return key if len(key) >= 3 else None
+
+    def forget_oldest(self):
+        _, _, created, name = self.joins.popleft()
+        self.created_counts[created] -= 1
+        if not self.created_counts[created]:
+            del self.created_counts[created]
+        if name is not None:
+            self.name_counts[name] -= 1
+            if not self.name_counts[name]:
+                del self.name_counts[name]
+
+    def check(self, member: discord.Member, now: float) -> dict[str, str]:
+        # Returns the thresholds this join trips, by name
+        while self.joins and now - self.joins[0][0] > self.window:
+            self.forget_oldest()
+        if len(self.joins) >= self.buffer_size:
+            self.forget_oldest()
+
+        created = int(member.created_at.timestamp()) // 3600
+        name = self.name_key(member.name)
+        self.joins.append((now, member.id, created, name))
+        self.created_counts[created] += 1
+        if name is not None:
+            self.name_counts[name] += 1
+
+        tripped = {}
+        if len(self.joins) >= self.join_threshold:
+            tripped["joins"] = f"{len(self.joins)} joins in the last {self.window} seconds"
+        if self.created_counts[created] >= self.cluster_threshold:
+            tripped["created"] = f"{self.created_counts[created]} accounts created within the same hour"
+        if name is not None and self.name_counts[name] >= self.name_threshold:
+            tripped["name"] = f"{self.name_counts[name]} similar usernames (\"{name}\")"
+        return tripped
+
+    def record_join(self, member: discord.Member):
+        now = time.monotonic()
+        tripped = self.check(member, now)
+        if not tripped:
+            return
+
+        if now >= self.raid_until:
+            # A new raid, flag everyone in the window who matches what tripped
+            self.raids += 1
+            self.flagged.clear()
+            _, _, created, name = self.joins[-1]
+            for _, member_id, joined_created, joined_name in self.joins:
+                if "joins" in tripped or ("created" in tripped and joined_created == created) or ("name" in tripped and joined_name == name):
+                    self.flag(member.guild, member_id)
+            run_in_background(self.lock_down(member.guild, list(tripped.values())), "raid lockdown")
+        else:
+            self.flag(member.guild, member.id)
+        self.raid_until = now + self.cooldown
+
+    def flag(self, guild: discord.Guild, member_id: int):
+        if member_id in self.flagged:
+            return
+        self.flagged.add(member_id)
+        if RAID_ACTION not in ("timeout", "kick"):
+            return
+        try:
+            self.actions.put_nowait((guild, member_id))
+        except asyncio.QueueFull:
+            logger.warning(f"Raid action queue is full, member {member_id} was flagged but not {RAID_ACTION}ed.")
+
+    async def lock_down(self, guild: discord.Guild, reasons: list[str]):
+        outbound_priority.set(PRIORITY_MODERATION)
+        logger.warning(f"Raid detected in {guild.name}: {', '.join(reasons)}.")
+
+        raised = False
+        level = getattr(discord.VerificationLevel, str(RAID_VERIFICATION_LEVEL).lower(), None) if RAID_VERIFICATION_LEVEL else None
+        if level is not None and guild.verification_level < level:
+            try:
+                await guild.edit(verification_level=level, reason="Raid detected")
+                raised = True
+                logger.info(f"Raised the verification level of {guild.name} to {level.name} because of a raid.")
+            except discord.HTTPException as e:
+                logger.error(f"Failed to raise the verification level during a raid: {e}")
+
+        reason_list = "\n".join(f"> - {reason}" for reason in reasons)
+        embed = discord.Embed(
+            title="🚨 Raid Detected!",
+            description=(
+                f"{reason_list}\n> \n"
+                f"> **Flagged Members:** {len(self.flagged)}\n"
+                f"> **Action:** {RAID_ACTION.capitalize()}\n"
+                f"> **Verification Level:** {'Raised to ' + level.name.capitalize() if raised else 'Unchanged'}"
+            ),
+            color=colors["red"]
+        )
+        embed.set_footer(text="The verification level stays raised until staff lower it again.")
+        log_sink.send(embed)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.action_worker()) for _ in range(RAID_ACTION_WORKERS)]
+
+    async def action_worker(self):
+        outbound_priority.set(PRIORITY_MODERATION)
+        while True:
+            guild, member_id = await self.actions.get()
+            try:
+                member = guild.get_member(member_id)
+                if member is None or has_staff_level(member, MOD_LEVEL):
+                    continue
+                if RAID_ACTION == "kick":
+                    await member.kick(reason="Flagged by the raid detector")
+                else:
+                    until = discord.utils.utcnow() + datetime.timedelta(minutes=RAID_TIMEOUT_MINUTES)
+                    await member.edit(communication_disabled_until=until, reason="Flagged by the raid detector")
+                logger.info(f"Raid detector: {RAID_ACTION} applied to {member} (ID: {member.id}).")
+            except discord.HTTPException as e:
+                logger.error(f"Raid detector failed to {RAID_ACTION} member {member_id}: {e}")
+            finally:
+                self.actions.task_done()
+
+
+raid_detector = RaidDetector(RAID_WINDOW, RAID_BUFFER_SIZE, RAID_JOIN_THRESHOLD, RAID_CLUSTER_THRESHOLD, RAID_NAME_THRESHOLD, RAID_COOLDOWN)
+
+# ======================================================================================================================================================================================
+# Bot Event for member joins:
+# Part One: DM the Member
+
+@bot.event
+async def on_member_join(member: discord.Member):
+    outbound_priority.set(PRIORITY_NOTICE)
+    rules_channel = bot.get_channel(RULES_CHANNEL_ID)
+    raid_detector.record_join(member)
+    batching = welcome_batcher.record_join()
+
     embed = discord.Embed(
-        title="🎉 Welcome to the Server!",
-        description=(
-            f"> Hey {member.mention}, welcome to **{member.guild.name}**!\n"
-            f"> We're so excited to have you here!\n> \n"
-            f"> Please remember to read the **Rules**."
-        ),
+        title="🎉 Welcome!",
+        description=f"> Thank you for joining {member.guild.name}!\n> We're happy to get the chance to chat with you!\n> \n> - Make sure to check out the **Rules**\n> \n> - Chat and Enjoy our wonderful server",
         color=colors["gold"]
     )
-    embed.set_thumbnail(url=member.avatar.url)  # User's profile picture
     embed.set_footer(
-        text=f"Member #{len(member.guild.members)}",
+        text="This message was written by server staff.",
     )
-    # Send the embed in the channel
-    await welcome_channel.send(f"{member.mention}", embed=embed)
+
+    # Sent by the welcome DM workers, paused while members are joining too fast
+    welcome_batcher.queue_dm(member, embed)
+
+    # ======================================================================================================================================================================================
+    # Bot Event for member joins:
+    # Part Two: Send to Welcome Channel
+
+    if batching:
+        # Welcomed together with everyone else in the next summary message
+        welcome_batcher.add(member)
+    else:
+        # Define the channel to send the message
+        welcome_channel = bot.get_channel(WELCOME_CHANNEL_ID)
+        # Create the embed
+        embed = discord.Embed(
+            title="🎉 Welcome to the Server!",
+            description=(
+                f"> Hey {member.mention}, welcome to **{member.guild.name}**!\n"
+                f"> We're so excited to have you here!\n> \n"
+                f"> Please remember to read the **Rules**."
+            ),
+            color=colors["gold"]
+        )
+        embed.set_thumbnail(url=member.display_avatar.url)  # User's profile picture
+        embed.set_footer(
+            text=f"Member #{len(member.guild.members)}",
+        )
+        # Send the embed in the channel
+        await welcome_channel.send(f"{member.mention}", embed=embed)
 
     # ======================================================================================================================================================================================
     # Bot Event for member joins:
@@ -561,14 +3139,13 @@ async def on_member_join(member: discord.Member):
         description=f"> {member.name}\n> \n> ({member.mention})",
         color=colors["orange"]
     )
-    embed.set_thumbnail(url=member.avatar.url)  # User's profile picture
+    embed.set_thumbnail(url=member.display_avatar.url)  # User's profile picture
     embed.set_footer(
         text=f"Member #{len(member.guild.members)}",
     )
 
-    # Send embed in text-logs channel
-    if text_log_channel is not None:
-        await text_log_channel.send(embed=embed)
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
     # Log when a new member joins
     logger.info(f"Member joined: {member.name} (ID: {member.id}).")
@@ -581,20 +3158,20 @@ async def on_member_join(member: discord.Member):
 async def on_member_remove(member: discord.Member):
     # Log when a member leaves
     logger.info(f"Member left: {member.name} (ID: {member.id}).")
+    staff_resolver.forget(member)
 
     embed = discord.Embed(
         title=f"Member Left!",
         description=f"> {member.name}",
         color=colors["orange"]
     )
-    embed.set_thumbnail(url=member.avatar.url)  # User's profile picture
+    embed.set_thumbnail(url=member.display_avatar.url)  # User's profile picture
     embed.set_footer(
         text=f"Member #{len(member.guild.members)}",
     )
 
-    # Send embed in text-logs channel
-    if text_log_channel is not None:
-        await text_log_channel.send(embed=embed)
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
 
 # ======================================================================================================================================================================================
@@ -613,9 +3190,8 @@ async def on_guild_join(guild: discord.Guild):
         color=colors["white"]
     )
 
-    # Send embed in text-logs channel
-    if text_log_channel is not None:
-        await text_log_channel.send(embed=embed)
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
 
 # ======================================================================================================================================================================================
@@ -632,9 +3208,8 @@ async def on_guild_remove(guild: discord.Guild):
         color=colors["white"]
     )
 
-    # Send embed in text-logs channel
-    if text_log_channel is not None:
-        await text_log_channel.send(embed=embed)
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
 
 # ======================================================================================================================================================================================
@@ -651,9 +3226,8 @@ async def on_error(event):
         color=colors["dark_red"]
     )
 
-    # Send embed in text-logs channel
-    if text_log_channel is not None:
-        await text_log_channel.send(embed=embed)
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
 
 # ======================================================================================================================================================================================
@@ -673,9 +3247,8 @@ async def on_message_delete(message: discord.Message):
                 color=colors["red"]
             )
 
-            # Send embed in text-logs channel
-            if text_log_channel is not None:
-                await text_log_channel.send(embed=embed)
+            # Queue embed for the text-logs channel
+            log_sink.send(embed)
         else:
             return
 
@@ -705,11 +3278,181 @@ async def on_message_edit(before: discord.Message, after: discord.Message):
                 color=colors["yellow"]
             )
 
-            # Send embed in text-logs channel
-            if text_log_channel is not None:
-                await text_log_channel.send(embed=embed)
-        else:
-            return
+            # Queue embed for the text-logs channel
+            log_sink.send(embed)
+
+            if after.content != before.content:
+                await enforce_filter(after.channel, after.id, after.author, after.content)
+        else:
+            return
+
+# ======================================================================================================================================================================================
+# Compact message cache
+# on_message_delete and on_message_edit only fire for messages still in the library's cache, which holds
+# full Message objects and forgets them quickly. This keeps just the parts the logs need, so far more
+# messages fit in the same memory, and the raw events below log the ones the library forgot.
+
+MESSAGE_CACHE_SIZE = config.get("MESSAGE_CACHE_SIZE", 50000)  # Messages remembered across all channels
+MESSAGE_CACHE_PER_CHANNEL = config.get("MESSAGE_CACHE_PER_CHANNEL", 0)  # Messages remembered per channel (0 = no limit)
+
+
+class CachedMessage:
+    __slots__ = ("id", "author_id", "channel_id", "content", "attachment_urls")
+
+    def __init__(self, message: discord.Message):
+        self.id = message.id
+        self.author_id = message.author.id
+        self.channel_id = message.channel.id
+        self.content = message.content
+        self.attachment_urls = tuple(attachment.url for attachment in message.attachments)
+
+
+class MessageCache:
+    """A least-recently-used cache of CachedMessage, limited globally and optionally per channel."""
+
+    def __init__(self, max_size: int, max_per_channel: int):
+        self.max_size = max_size
+        self.max_per_channel = max_per_channel
+        self.messages = collections.OrderedDict()  # message ID -> CachedMessage, oldest first
+        self.channels = {}  # channel ID -> OrderedDict of message IDs, oldest first
+
+    def add(self, message: discord.Message):
+        cached = CachedMessage(message)
+        self.messages[cached.id] = cached
+        channel_messages = self.channels.setdefault(cached.channel_id, collections.OrderedDict())
+        channel_messages[cached.id] = None
+
+        if self.max_per_channel and len(channel_messages) > self.max_per_channel:
+            self.pop(next(iter(channel_messages)))
+        if len(self.messages) > self.max_size:
+            self.pop(next(iter(self.messages)))
+
+    def get(self, message_id: int) -> CachedMessage | None:
+        cached = self.messages.get(message_id)
+        if cached is not None:
+            # Edited messages stay around longer than ones nobody touched
+            self.messages.move_to_end(message_id)
+            self.channels[cached.channel_id].move_to_end(message_id)
+        return cached
+
+    def pop(self, message_id: int) -> CachedMessage | None:
+        cached = self.messages.pop(message_id, None)
+        if cached is not None:
+            channel_messages = self.channels[cached.channel_id]
+            del channel_messages[message_id]
+            if not channel_messages:
+                del self.channels[cached.channel_id]
+        return cached
+
+
+message_cache = MessageCache(MESSAGE_CACHE_SIZE, MESSAGE_CACHE_PER_CHANNEL)
+
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    cached = message_cache.pop(payload.message_id)
+
+    # The library still had it, so on_message_delete already logged it
+    if payload.cached_message is not None or cached is None:
+        return
+
+    author = bot.get_user(cached.author_id) or cached.author_id
+    channel = bot.get_channel(cached.channel_id) or cached.channel_id
+    content = cached.content
+    if cached.attachment_urls:
+        content += "\n> " + "\n> ".join(cached.attachment_urls)
+
+    logger.info(f"Message from {author} deleted in #{channel}: '{content}'")
+
+    embed = discord.Embed(
+        title=f"Message from {author} deleted in {channel}",
+        description=f"> {content}",
+        color=colors["red"]
+    )
+
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    # Purges: log every message the library or our cache still had, in one embed
+    library_messages = {message.id: message for message in payload.cached_messages}
+    lines = []
+    for message_id in sorted(payload.message_ids):
+        cached = message_cache.pop(message_id)
+        message = library_messages.get(message_id)
+        if message is not None:
+            if message.author.bot:
+                continue
+            author, content = message.author, message.content
+        elif cached is not None:
+            author = bot.get_user(cached.author_id) or cached.author_id
+            content = cached.content
+            if cached.attachment_urls:
+                content += " " + " ".join(cached.attachment_urls)
+        else:
+            continue
+        lines.append(f"> **{author}:** {content}")
+
+    if not lines:
+        return
+
+    channel = bot.get_channel(payload.channel_id) or payload.channel_id
+    logger.info(f"{len(payload.message_ids)} messages bulk deleted in #{channel}:\n" + "\n".join(lines))
+
+    embed = discord.Embed(
+        title=f"{len(payload.message_ids)} messages deleted in {channel}",
+        description="\n".join(lines)[:4096],
+        color=colors["red"]
+    )
+
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
+
+
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    cached = message_cache.get(payload.message_id)
+    content = payload.data.get("content")
+
+    # Embed updates and the like don't include the content
+    if cached is None or content is None or content == cached.content:
+        return
+
+    before = cached.content
+    cached.content = content
+
+    # The library still had it, so on_message_edit already logged and filtered it
+    if payload.cached_message is not None:
+        return
+
+    author = bot.get_user(cached.author_id) or cached.author_id
+    channel = bot.get_channel(cached.channel_id) or cached.channel_id
+
+    if isinstance(channel, discord.abc.GuildChannel):
+        member = channel.guild.get_member(cached.author_id)
+        if member is not None:
+            await enforce_filter(channel, payload.message_id, member, content)
+
+    logger.info(
+        f"Message from {author} edited in #{channel}:\n"
+        f"- Before: '{before}'\n"
+        f"- After: '{content}'"
+    )
+
+    embed = discord.Embed(
+        title=f"Message from {author} edited in {channel}",
+        description=(
+            f"Message from {author} edited in #{channel}:\n"
+            f"> - Before: '{before}'\n"
+            f"> - After: '{content}'"
+        ),
+        color=colors["yellow"]
+    )
+
+    # Queue embed for the text-logs channel
+    log_sink.send(embed)
 
 # ======================================================================================================================================================================================
 # EVERYONE COMMANDS (Power Level 0)
@@ -735,6 +3478,132 @@ class DoneButton(discord.ui.View):
                 "❌ You are not allowed to delete this message!", ephemeral=True
             )
 
+# ======================================================================================================================================================================================
+# Paginated lists
+# Long lists (warnings, bans) are shown a page at a time. A PageSource is a window into a list that's already
+# sorted, so a page is read by index and only the entries on it are rendered, however long the list is.
+
+class PageSource:
+    """Part of a sorted list, read one page at a time."""
+
+    def __init__(self, items, start: int = 0, end: int | None = None, reverse: bool = False):
+        # Only the references are copied, so bans and warnings added while the view is open don't shift its pages
+        self.items = items[start:end]
+        self.reverse = reverse
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def page(self, number: int, size: int) -> list:
+        first = number * size
+        last = min(first + size, len(self))
+        if self.reverse:
+            return [self.items[len(self) - 1 - index] for index in range(first, last)]
+        return self.items[first:last]
+
+
+class JumpToPageModal(discord.ui.Modal):
+    def __init__(self, paginator: "Paginator"):
+        super().__init__(title="Jump to Page")
+        self.paginator = paginator
+        self.add_item(discord.ui.InputText(label=f"Page (1-{paginator.pages})", max_length=6))
+
+    async def callback(self, interaction: discord.Interaction):
+        value = self.children[0].value.strip()
+        if not value.isdigit():
+            await interaction.response.send_message("❌ That's not a page number.", ephemeral=True)
+            return
+
+        self.paginator.page = min(max(int(value), 1), self.paginator.pages) - 1
+        await interaction.response.edit_message(embed=self.paginator.render(), view=self.paginator)
+
+
+class Paginator(discord.ui.View):
+    MAX_DESCRIPTION = 4096  # Discord's limit for an embed description
+
+    def __init__(self, author_id: int, title: str, color: int, sources: dict[str, PageSource], render_entry, page_size: int = 10):
+        super().__init__(timeout=600)
+        self.author_id = author_id
+        self.title = title
+        self.color = color
+        self.sources = sources  # Sort option label -> PageSource, the first one is the default
+        self.render_entry = render_entry
+        self.page_size = page_size
+        self.sort = next(iter(sources))
+        self.page = 0
+
+        if len(sources) > 1:
+            select = discord.ui.Select(
+                placeholder="Sort by...",
+                options=[discord.SelectOption(label=label, default=label == self.sort) for label in sources],
+                row=1
+            )
+            select.callback = self.sort_selected
+            self.add_item(select)
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-len(self.sources[self.sort]) // self.page_size))
+
+    def render(self) -> discord.Embed:
+        source = self.sources[self.sort]
+        self.page = min(self.page, self.pages - 1)
+        description = "\n".join(self.render_entry(entry) for entry in source.page(self.page, self.page_size))
+        if len(description) > self.MAX_DESCRIPTION:
+            description = description[:self.MAX_DESCRIPTION - 3] + "..."
+
+        self.previous_button.disabled = self.page == 0
+        self.next_button.disabled = self.page >= self.pages - 1
+        self.jump_button.label = f"Page {self.page + 1}/{self.pages}"
+
+        embed = discord.Embed(title=self.title, description=description or "> Nothing to show.", color=self.color)
+        embed.set_footer(text=f"{len(source)} entries • Sorted by {self.sort}")
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("❌ You are not allowed to use these buttons!", ephemeral=True)
+            return False
+        return True
+
+    async def on_timeout(self):
+        try:
+            if self.message is not None:
+                await self.message.edit(view=None)
+        except discord.HTTPException:
+            pass
+
+    @discord.ui.button(label="◀", style=discord.ButtonStyle.secondary)
+    async def previous_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.page -= 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Page", style=discord.ButtonStyle.secondary)
+    async def jump_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await interaction.response.send_modal(JumpToPageModal(self))
+
+    @discord.ui.button(label="▶", style=discord.ButtonStyle.secondary)
+    async def next_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        self.page += 1
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
+    @discord.ui.button(label="Done", style=discord.ButtonStyle.primary)
+    async def done_button(self, button: discord.ui.Button, interaction: discord.Interaction):
+        await interaction.response.defer()
+        try:
+            await interaction.message.delete()
+        except discord.NotFound:
+            await interaction.followup.send("❌ Message already deleted.", ephemeral=True)
+        self.stop()
+
+    async def sort_selected(self, interaction: discord.Interaction):
+        select = self.children[-1]
+        self.sort = select.values[0]
+        self.page = 0
+        for option in select.options:
+            option.default = option.label == self.sort
+        await interaction.response.edit_message(embed=self.render(), view=self)
+
 # ======================================================================================================================================================================================
 # HELP MENU INFORMATION
 
@@ -756,9 +3625,11 @@ HELP_DESCRIPTION = (
     "> **`/mute @user <duration(add 's', 'm', 'h', etc.> <reason>`** → Mutes a member.\n"
     "\n"
     "> **⚙️ System Commands (Admins Only):**\n"
-    "> **`/ban @user <reason>`** → Bans a user (Admin only).\n"
+    "> **`/ban @user <reason> [duration]`** → Bans a user, for a while if a duration is given (Admin only).\n"
     "> **`/restart`** → Restarts the bot safely (Admin only).\n"
     "> **`/ping`** → Displays bot latency (Admin only).\n"
+    "> **`/migrate`** → Copies the JSON data into the SQLite database (Admin only).\n"
+    "> **`/lag`** → Shows event loop lag and the slowest handlers (Admin only).\n"
     "\n"
     "> **📩 ModMail System:**\n"
     "> Send '**contact**' in a DM to this bot to create a ModMail thread.\n"
@@ -769,9 +3640,10 @@ HELP_DESCRIPTION = (
 # Help Command Embed
 
 @bot.slash_command(name="help")
-@commands.cooldown(1, 60, commands.BucketType.user)
 async def help_command(ctx: discord.ApplicationContext):
 
+    if await on_cooldown(ctx, help_limiter, ctx.author.id):
+        return
 
     # Create embed with all the information in the description field
     embed = discord.Embed(
@@ -787,19 +3659,6 @@ async def help_command(ctx: discord.ApplicationContext):
     logger.info(f"{ctx.author} triggered the 'help' command in {ctx.channel}. Output sent.")
 
 
-@help_command.error
-async def help_error(ctx, error):
-
-    if isinstance(error, commands.CommandOnCooldown):
-        embed = discord.Embed(
-            title="> ⏳ Cooldown!",
-            description=f"> This command is on cooldown! \n> Try again in `{error.retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} triggered the 'help' command in {ctx.channel}. Output not sent due to cooldown.")
-
 # ======================================================================================================================================================================================
 # AFK Command
 
@@ -807,8 +3666,8 @@ async def help_error(ctx, error):
 async def afk(ctx, *, reason: str = "No reason provided"):
 
     user_id = str(ctx.author.id)
-    if user_id in afk_users:
-        afk_info = afk_users[user_id]
+    afk_info = afk_store.get(user_id)
+    if afk_info is not None:
         afk_time = int(time.time() - afk_info["time"])
         embed = discord.Embed(title="Already AFK", description=f"You are already AFK!",
                               color=colors["orange"])
@@ -818,9 +3677,9 @@ async def afk(ctx, *, reason: str = "No reason provided"):
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
         return
 
-    afk_users[user_id] = {"reason": reason, "time": time.time()}
-    with open(AFK_FILE, "w") as f:
-        json.dump(afk_users, f)
+    afk_store.set(user_id, reason)
+    if AFK_EXPIRE_HOURS:
+        timer_store.schedule("afk", ctx.author.id, time.time() + AFK_EXPIRE_HOURS * 3600)
     embed = discord.Embed(title="AFK Set", description=f"You are now AFK!", color=colors["blue"])
     embed.add_field(name="Reason:", value=reason, inline=False)
     view = DoneButton(ctx.author.id)
@@ -841,9 +3700,10 @@ except (FileNotFoundError, json.JSONDecodeError):
 
 
 @bot.slash_command()
-@commands.cooldown(1, 15, commands.BucketType.user)
 async def slap(ctx: discord.ApplicationContext, user: str = None):
-      # Delete the command message
+
+    if await on_cooldown(ctx, slap_limiter, ctx.author.id):
+        return
 
     # Ensure slap GIFs are available
     if not slap_gifs:
@@ -911,20 +3771,6 @@ async def slap(ctx: discord.ApplicationContext, user: str = None):
     logger.info(f"{ctx.author} slapped {target_user} in {ctx.channel}.")
 
 
-@slap.error
-async def slap_error(ctx, error):
-
-    if isinstance(error, commands.CommandOnCooldown):
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! \n> Try again in `{error.retry_after:.2f}` seconds.",
-            color=discord.Color.red()
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} triggered 'slap' but was on cooldown.")
-
-
 # ======================================================================================================================================================================================
 # Topic Command
 
@@ -941,10 +3787,12 @@ topic_index = 0  # Tracks the current topic
 
 
 @bot.slash_command()
-@commands.cooldown(1, 15, commands.BucketType.user)
 async def topic(ctx: discord.ApplicationContext):
     global topic_index
 
+    if await on_cooldown(ctx, topic_limiter, ctx.author.id):
+        return
+
     # Check if topics exist
     if not topics:
         embed = discord.Embed(
@@ -975,20 +3823,6 @@ async def topic(ctx: discord.ApplicationContext):
     logger.info(f"{ctx.author} triggered the 'topic' command in {ctx.channel}. Output sent.")
 
 
-@topic.error
-async def topic_error(ctx, error):
-
-    if isinstance(error, commands.CommandOnCooldown):
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! \n> Try again in `{error.retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} triggered the 'topic' command in {ctx.channel}. Output not sent due to cooldown.")
-
-
 # ======================================================================================================================================================================================
 # MODERATOR COMMANDS (Power Level 1)
 # ======================================================================================================================================================================================
@@ -999,7 +3833,7 @@ async def activity(ctx: discord.ApplicationContext):
 
 
     # Check if the user has the moderator role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1012,21 +3846,9 @@ async def activity(ctx: discord.ApplicationContext):
         return  # Exit early before applying cooldown
 
     # Apply cooldown only if user has the proper role
-    if ctx.command.is_on_cooldown(ctx):
-        retry_after = ctx.command.get_cooldown_retry_after(ctx)
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! Try again in `{retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} tried 'activity' in {ctx.channel}, but it's on cooldown.")
+    if await on_cooldown(ctx, activity_limiter, ctx.guild.id):
         return
 
-    # Apply cooldown manually
-    ctx.command.reset_cooldown(ctx)  # Ensures that only successful attempts trigger the cooldown
-
     # Fetch the role
     activity_ping_role = ctx.guild.get_role(ACTIVITY_PING_ROLE_ID)
 
@@ -1072,7 +3894,7 @@ async def version(ctx: discord.ApplicationContext):
 
 
     # Check if the user has the moderator role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1085,21 +3907,9 @@ async def version(ctx: discord.ApplicationContext):
         return  # Exit early before applying cooldown
 
     # Apply cooldown only if user has the proper role
-    if ctx.command.is_on_cooldown(ctx):
-        retry_after = ctx.command.get_cooldown_retry_after(ctx)
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! Try again in `{retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} tried 'version' in {ctx.channel}, but it's on cooldown.")
+    if await on_cooldown(ctx, version_limiter, ctx.author.id):
         return
 
-    # Apply cooldown manually after permission check
-    ctx.command.reset_cooldown(ctx)
-
     # Create and send the version embed
     embed = discord.Embed(
         title="🔔 Version",
@@ -1117,12 +3927,11 @@ async def version(ctx: discord.ApplicationContext):
 # Member Info Command
 
 @bot.slash_command()
-@commands.cooldown(1, 10, commands.BucketType.user)  # 10-second cooldown per user
 async def member(ctx: discord.ApplicationContext, member: discord.Member = None):
 
 
     # Check if the user has a moderator role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1134,6 +3943,10 @@ async def member(ctx: discord.ApplicationContext, member: discord.Member = None)
         logger.info(f"{ctx.author} attempted to use 'member' in {ctx.channel} but lacks permissions.")
         return
 
+    # Apply cooldown only if user has the proper role
+    if await on_cooldown(ctx, member_limiter, ctx.author.id):
+        return
+
     # If no member is mentioned, use the command author
     if member is None:
         member = ctx.author
@@ -1188,20 +4001,6 @@ async def member(ctx: discord.ApplicationContext, member: discord.Member = None)
     logger.info(f"{ctx.author} triggered 'member' for {member} in {ctx.channel}.")
 
 
-# Handle cooldown only for authorized users
-@member.error
-async def member_error(ctx, error):
-
-    if isinstance(error, commands.CommandOnCooldown):
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! Try again in `{error.retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} triggered 'member' in {ctx.channel}, but it's on cooldown.")
-
 # ======================================================================================================================================================================================
 # Say Command
 
@@ -1210,7 +4009,7 @@ async def say(ctx: discord.ApplicationContext, *, message: str = None):
       # Delete the command message
 
     # Check if the user has the correct roles
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1256,24 +4055,129 @@ async def say(ctx: discord.ApplicationContext, *, message: str = None):
 
 # Ensure moderation folder exists
 WARN_FOLDER = "moderation/warns"
+WARN_JOURNAL_FILE = "moderation/warns_journal.jsonl"
+WARN_COMPACT_THRESHOLD = 500  # Journal entries before they're merged into the per-user files
 os.makedirs(WARN_FOLDER, exist_ok=True)
 
-# Function to load warnings
-def load_warns():
-    warns = {}
-    for file in os.listdir(WARN_FOLDER):
-        if file.endswith(".json"):
-            with open(os.path.join(WARN_FOLDER, file), "r") as f:
-                warns[file.replace(".json", "")] = json.load(f)
-    return warns
 
-# Function to save warnings
-def save_warn(user_id, data):
-    with open(os.path.join(WARN_FOLDER, f"{user_id}.json"), "w") as f:
-        json.dump(data, f, indent=4)
+class WarnJournal:
+    """
+    Saves warnings as lines appended to one journal file instead of rewriting a user's history.
+    Every so often the journal is merged into the usual "<user_id>.json" files and emptied.
+    """
+
+    def __init__(self, folder: str, journal_path: str):
+        self.folder = folder
+        self.journal_path = journal_path
+        self.unmerged = {}  # user ID -> warnings that are only in the journal so far
+        self.journal_count = 0
+        self.sequence = 0  # Every journaled warning gets the next number, and keeps it as "seq" once merged
+
+    def load(self) -> dict:
+        warns = {}
+        for file in os.listdir(self.folder):
+            if file.endswith(".json"):
+                user_warns = warns[file.replace(".json", "")] = read_json(os.path.join(self.folder, file), [])
+                self.sequence = max(self.sequence, max((warn.get("seq", 0) for warn in user_warns), default=0))
+
+        # Replay anything that wasn't merged before the bot stopped
+        if os.path.exists(self.journal_path):
+            merged = {}  # user ID -> sequence numbers already in the user's file
+            with open(self.journal_path, "r") as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # A line cut short by a crash
+                    user_id = record["user_id"]
+                    user_warns = warns.setdefault(user_id, [])
+                    seq = record.get("seq")
+                    warn = dict(record["warn"], seq=seq) if seq is not None else record["warn"]
+                    self.sequence = max(self.sequence, seq or 0)
+
+                    # Skip entries that already made it into the user's file before a crash
+                    if user_id not in merged:
+                        merged[user_id] = {existing.get("seq") for existing in user_warns} - {None}
+                    if seq not in merged[user_id]:
+                        user_warns.append(warn)
+                    self.unmerged.setdefault(user_id, []).append(warn)
+                    self.journal_count += 1
+
+        return warns
+
+    def apply(self, entries: list):
+        with open(self.journal_path, "a") as journal:
+            for user_id, warn in entries:
+                self.sequence += 1
+                journal.write(json.dumps({"seq": self.sequence, "user_id": user_id, "warn": warn}) + "\n")
+                self.unmerged.setdefault(user_id, []).append(dict(warn, seq=self.sequence))
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self.journal_count += len(entries)
+        if self.journal_count >= WARN_COMPACT_THRESHOLD:
+            self.compact()
+
+    def compact(self):
+        # Only the users that appear in the journal get their file rewritten
+        for user_id, new_warns in self.unmerged.items():
+            path = os.path.join(self.folder, f"{user_id}.json")
+            user_warns = read_json(path, [])
+            merged = {warn.get("seq") for warn in user_warns} - {None}
+            user_warns.extend(warn for warn in new_warns if warn.get("seq") is None or warn["seq"] not in merged)
+            write_json_atomic(path, user_warns)
+
+        # If we crash before this, the replay in load() skips the entries that were already merged
+        open(self.journal_path, "w").close()
+        self.unmerged.clear()
+        self.journal_count = 0
+
+
+class WarnLedger(WriteBehindStore):
+    """Every user's warnings, loaded once and kept in memory."""
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.warns = backend.load()  # user ID (as a string) -> list of warnings
+        self.pending = []
+        self._summary = None
+
+    def get(self, user_id: str) -> list:
+        return self.warns.get(user_id, [])
+
+    def count(self, user_id: str) -> int:
+        return len(self.warns.get(user_id, ()))
+
+    def summary(self) -> list[tuple[str, int]]:
+        # (user ID, warning count) for every warned user, most warned first. Rebuilt only after a change.
+        if self._summary is None:
+            self._summary = sorted(
+                ((user_id, len(user_warns)) for user_id, user_warns in self.warns.items() if user_warns),
+                key=lambda item: item[1],
+                reverse=True
+            )
+        return self._summary
+
+    def add(self, user_id: str, warn: dict):
+        self.warns.setdefault(user_id, []).append(warn)
+        self.pending.append((user_id, warn))
+        self._summary = None
+
+    def snapshot(self, key):
+        # Warnings are saved as journal entries by collect(), but a user's list can still be copied
+        user_warns = self.warns.get(key)
+        return list(user_warns) if user_warns is not None else None
+
+    def collect(self):
+        entries = self.pending
+        self.pending = []
+        return entries
+
+    def restore(self, changes):
+        self.pending[:0] = changes
+
 
-# Load warns initially
-warns = load_warns()
+warn_ledger = WarnLedger(SQLiteWarnLog(database) if database else WarnJournal(WARN_FOLDER, WARN_JOURNAL_FILE))
 
 # ======================================================================================================================================================================================
 # Kick Command
@@ -1283,7 +4187,7 @@ async def kick(ctx: discord.ApplicationContext, member: discord.Member = None, *
 
 
     # Ensure the user issuing the kick has moderator, admin, or servicer role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1306,7 +4210,7 @@ async def kick(ctx: discord.ApplicationContext, member: discord.Member = None, *
         return
 
     # Ensure the user being kicked is not a moderator, admin, or servicer
-    if is_staff(member, True, True, True):
+    if has_staff_level(member, MOD_LEVEL):
         embed = discord.Embed(
             title="❌ Cannot Kick Staff",
             description="> You cannot kick a **Moderator, Administrator, or Servicer**.",
@@ -1316,18 +4220,13 @@ async def kick(ctx: discord.ApplicationContext, member: discord.Member = None, *
         logger.info(f"{ctx.author} attempted to kick {member}, but they have a protected role.")
         return
 
-    # Load existing warnings for the user
-    user_id = str(member.id)
-    warns = load_warns().get(user_id, [])
-
     # Add the kick as a warning entry
-    warns.append({
+    warn_ledger.add(str(member.id), {
         "warned_by": str(ctx.author),
         "warned_by_id": ctx.author.id,
         "reason": f"[KICK] {reason}",
         "date": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M:%S")
     })
-    save_warn(user_id, warns)
 
     # Try to kick the user
     try:
@@ -1370,7 +4269,7 @@ async def warn(ctx: discord.ApplicationContext, member: discord.Member = None, *
 
 
     # Ensure the user issuing the warning has moderator, admin, or servicer role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(title="❌ Permission Denied", description="> You need the **Moderator** Role or above to use this command.", color=colors["red"])
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
@@ -1385,24 +4284,19 @@ async def warn(ctx: discord.ApplicationContext, member: discord.Member = None, *
         return
 
     # Ensure the user being warned is not a moderator, admin, or servicer
-    if is_staff(member, True, True, True):
+    if has_staff_level(member, MOD_LEVEL):
         embed = discord.Embed(title="❌ Cannot Warn Staff", description="> You cannot warn a **Moderator, Administrator, or Servicer**.", color=colors["red"])
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
         logger.info(f"{ctx.author} attempted to warn {member}, but they have a protected role.")
         return
 
-    # Load existing warnings for the user
-    user_id = str(member.id)
-    warns = load_warns().get(str(user_id), [])
-
     # Add the new warning
-    warns.append({
+    warn_ledger.add(str(member.id), {
         "warned_by": str(ctx.author),
         "warned_by_id": ctx.author.id,
         "reason": reason,
         "date": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M:%S")
     })
-    save_warn(user_id, warns)
 
     # Send confirmation
     embed = discord.Embed(title="⚠️ User Warned", description=f"> **{member}** has been warned.\n> **Reason:** {reason}", color=colors["orange"])
@@ -1413,29 +4307,36 @@ async def warn(ctx: discord.ApplicationContext, member: discord.Member = None, *
 
 # ======================================================================================================================================================================================
 # Warns Command
+def render_warn(warn: dict) -> str:
+    return f"> **Date:** {warn['date']}\n> **Reason:** {warn['reason'][:300]}\n> **Warned By:** {warn['warned_by']}\n"
+
+
+def render_warned_user(entry: tuple[str, int]) -> str:
+    user_id, count = entry
+    return f"> **{bot.get_user(int(user_id)) or 'Unknown User'}** ({user_id}) -  **Warnings:** {count}\n"
+
+
 @bot.slash_command(name="warns")
-async def warns_command(ctx: discord.ApplicationContext, member: discord.Member = None):
+async def warns_command(ctx: discord.ApplicationContext, member: discord.Member = None, minimum: Option(int, required=False, min_value=1, description="Only list users with at least this many warnings") = None):
 
 
     # Ensure the user has a moderator role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(title="❌ Permission Denied", description="> You need the **Moderator** Role or above to use this command.", color=colors["red"])
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
         logger.info(f"{ctx.author} attempted to use 'warns' in {ctx.channel} but lacks permissions.")
         return
 
-    # Load warnings
-    warns = load_warns()
-
     # Show warnings for a specific user
     if member:
-        user_id = str(member.id)
-        if user_id in warns and warns[user_id]:
-            warn_list = "\n".join([f"> **Date:** {warn['date']}\n> **Reason:** {warn['reason']}\n> **Warned By:** {warn['warned_by']}\n" for warn in warns[user_id]])
-            embed = discord.Embed(title=f"⚠️ Warnings for {member.display_name}", description=warn_list, color=colors["orange"])
-            view = DoneButton(ctx.author.id)
-            await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
+        user_warns = warn_ledger.get(str(member.id))
+        if user_warns:
+            view = Paginator(ctx.author.id, f"⚠️ Warnings for {member.display_name}", colors["orange"], {
+                "Newest first": PageSource(user_warns, reverse=True),
+                "Oldest first": PageSource(user_warns),
+            }, render_warn, page_size=8)
+            await ctx.respond(f"### {ctx.author.mention}", embed=view.render(), view=view)
             logger.info(f"{ctx.author} checked warnings for {member} in {ctx.channel}.")
         else:
             embed = discord.Embed(title="✅ No Warnings", description=f"> **{member}** has no recorded warnings.", color=colors["green"])
@@ -1443,12 +4344,15 @@ async def warns_command(ctx: discord.ApplicationContext, member: discord.Member
             logger.info(f"{ctx.author} checked warnings for {member} in {ctx.channel}, but none were found.")
         return
 
-    # Show all warnings
-    if warns:
-        all_warns = "\n".join([f"> **{bot.get_user(int(user))}** ({user}) -  **Warnings:** {len(warns[user])}\n" for user in warns])
-        embed = discord.Embed(title="⚠️ All User Warnings", description=all_warns, color=colors["orange"])
-        view = DoneButton(ctx.author.id)
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
+    # Show all warnings, the summary is sorted by count so the minimum just cuts it short
+    summary = warn_ledger.summary()
+    end = bisect.bisect_left(summary, 1 - minimum, key=lambda entry: -entry[1]) if minimum else len(summary)
+    if end:
+        view = Paginator(ctx.author.id, "⚠️ All User Warnings", colors["orange"], {
+            "Most warnings": PageSource(summary, end=end),
+            "Fewest warnings": PageSource(summary, end=end, reverse=True),
+        }, render_warned_user, page_size=15)
+        await ctx.respond(f"### {ctx.author.mention}", embed=view.render(), view=view)
         logger.info(f"{ctx.author} checked all warnings in {ctx.channel}.")
     else:
         embed = discord.Embed(title="✅ No Warnings Recorded", description="> There are no recorded warnings.", color=colors["green"])
@@ -1458,12 +4362,20 @@ async def warns_command(ctx: discord.ApplicationContext, member: discord.Member
 # ======================================================================================================================================================================================
 # Ban Info Command
 
+def render_ban(entry) -> str:
+    # Entries are ban records, user IDs (ban_registry.order) or (name, user ID) pairs (ban_registry.names)
+    if isinstance(entry, tuple):
+        entry = entry[1]
+    data = entry if isinstance(entry, dict) else ban_registry.bans[entry]
+    return f"> **{data['user']}**\n> \n> **ID:** ({data['user_id']})\n>  **Reason:** {data['reason'][:300]}\n> **Banned by:** {data['banned_by']}\n"
+
+
 @bot.slash_command()
 async def bans(ctx: discord.ApplicationContext, user_query: str = None):
 
 
     # Check if the user has the admin role
-    has_role = is_staff(ctx.author, False, True, True)
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1475,10 +4387,7 @@ async def bans(ctx: discord.ApplicationContext, user_query: str = None):
         logger.info(f"{ctx.author} attempted to use 'bans' in {ctx.channel} but lacks permissions.")
         return
 
-    # Load bans
-    bans = load_bans()
-
-    if not bans:
+    if not ban_registry.bans:
         embed = discord.Embed(
             title="📜 No Bans Found",
             description="> There are **no recorded bans** in the system.",
@@ -1490,29 +4399,31 @@ async def bans(ctx: discord.ApplicationContext, user_query: str = None):
 
     # If no user is specified, show the full ban list
     if not user_query:
-        ban_list = "\n".join([f"> **{data['user']}**\n> \n> **ID:** ({data['user_id']})\n>  **Reason:** {data['reason']}\n> **Banned by:** {data['banned_by']}\n" for data in bans.values()])
-
-        embed = discord.Embed(
-            title="🚫 Ban List",
-            description=ban_list if ban_list else "> No bans recorded.",
-            color=colors["red"]
-        )
-        view = DoneButton(ctx.author.id)
-        embed.set_footer(text="Use !bans <user> to search for a specific user.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
+        view = Paginator(ctx.author.id, "🚫 Ban List", colors["red"], {
+            "Newest first": PageSource(ban_registry.order, reverse=True),
+            "Oldest first": PageSource(ban_registry.order),
+            "Name (A-Z)": PageSource(ban_registry.names),
+            "Name (Z-A)": PageSource(ban_registry.names, reverse=True),
+        }, render_ban, page_size=5)
+        await ctx.respond(f"### {ctx.author.mention}", embed=view.render(), view=view)
         logger.info(f"{ctx.author} checked the full ban list in {ctx.channel}.")
         return
 
     # Search for the user by ID, username, or mention
     user_query = user_query.strip("<@!>")  # Remove mention formatting if applicable
-    found_ban = None
-
-    for user_id, data in bans.items():
-        if user_query == user_id or user_query.lower() == data["user"].lower():
-            found_ban = data
-            break
+    matches = ban_registry.search(user_query)
+
+    if len(matches) > 1:
+        # Every name starting with the query, not just the first few
+        start, end = ban_registry.prefix_range(user_query.lower())
+        sources = {"Name (A-Z)": PageSource(ban_registry.names, start, end), "Name (Z-A)": PageSource(ban_registry.names, start, end, reverse=True)} if end - start > 1 else {"Closest match": PageSource(matches)}
+        view = Paginator(ctx.author.id, "🔎 Multiple Ban Records Found", colors["orange"], sources, render_ban, page_size=5)
+        await ctx.respond(f"### {ctx.author.mention}", embed=view.render(), view=view)
+        logger.info(f"{ctx.author} searched for {user_query} in {ctx.channel} and found {len(matches)} ban records.")
+        return
 
-    if found_ban:
+    if matches:
+        found_ban = matches[0]
         embed = discord.Embed(
             title="🚫 Ban Record Found",
             description=(
@@ -1541,10 +4452,13 @@ async def bans(ctx: discord.ApplicationContext, user_query: str = None):
 
 # Unmute button class
 class UnmuteButton(discord.ui.View):
-    def __init__(self, moderator_id, member):
+    def __init__(self, moderator_id, member_id):
         super().__init__(timeout=None)
         self.moderator_id = moderator_id
-        self.member = member
+        self.member_id = member_id
+
+        # One custom_id per muted member, so arm_timers can register the button again after a restart
+        self.children[0].custom_id = f"unmute_button:{member_id}"
 
     @discord.ui.button(label="Unmute", style=discord.ButtonStyle.danger, custom_id="unmute_button")
     async def done_button(self, button: discord.ui.Button, interaction: discord.Interaction):
@@ -1553,25 +4467,53 @@ class UnmuteButton(discord.ui.View):
             await interaction.response.send_message("You are not authorized to unmute this user.", ephemeral=True)
             return
 
+        member = interaction.guild.get_member(self.member_id)
+        if member is None:
+            await interaction.response.send_message("❌ This user is no longer in the server.", ephemeral=True)
+            return
+
         # Unmute the user
         try:
-            await self.member.edit(communication_disabled_until=None)
-            await interaction.response.send_message(f"✅ **{self.member} has been unmuted!**", ephemeral=False)
+            await member.edit(communication_disabled_until=None)
+            timer_store.cancel("unmute", self.member_id)
+            await interaction.response.send_message(f"✅ **{member} has been unmuted!**", ephemeral=False)
             await asyncio.sleep(3)
             await interaction.delete_original_response()
 
             # Log the unmute action
-            logger.info(f"{interaction.user} unmuted {self.member}")
+            logger.info(f"{interaction.user} unmuted {member}")
 
         except discord.Forbidden:
             await interaction.response.send_message("❌ I lack the permissions to unmute this user.", ephemeral=True)
 
+# Turns "10m", "2h", "7d" and the like into seconds, or None if it isn't a valid duration
+def parse_duration(duration: str) -> int | None:
+    time_multipliers = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    unit = duration[-1:]
+    if unit not in time_multipliers or not duration[:-1].isdigit():
+        return None
+    return int(duration[:-1]) * time_multipliers[unit]
+
+
+# Shared by /mute and the spam detector
+async def apply_mute(member: discord.Member, seconds: int, reason: str, duration: str, muted_by: discord.abc.User):
+    until = discord.utils.utcnow() + datetime.timedelta(seconds=seconds)
+    await member.edit(communication_disabled_until=until, reason=reason)
+    timer_store.schedule("unmute", member.id, until.timestamp(), guild_id=member.guild.id, moderator_id=muted_by.id)
+
+    warn_ledger.add(str(member.id), {
+        "warned_by": str(muted_by),
+        "warned_by_id": muted_by.id,
+        "reason": f"[MUTE] {reason} (Duration: {duration})",
+        "date": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M:%S")
+    })
+
 @bot.slash_command()
 async def mute(ctx: discord.ApplicationContext, member: discord.Member = None, duration: str = None, *, reason: str = None):
 
 
     # Ensure the user issuing the mute has moderator, admin, or servicer role
-    has_role = is_staff(ctx.author, True, True, True)
+    has_role = has_staff_level(ctx.author, MOD_LEVEL)
     if not has_role:
         embed = discord.Embed(title="❌ Permission Denied", description="> You need the **Moderator** Role or above to use this command.", color=0xFF0000)
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
@@ -1586,51 +4528,33 @@ async def mute(ctx: discord.ApplicationContext, member: discord.Member = None, d
         return
 
     # Ensure the user being muted is not a moderator, admin, or servicer
-    if is_staff(member, True, True, True):
+    if has_staff_level(member, MOD_LEVEL):
         embed = discord.Embed(title="❌ Cannot Mute Staff", description="> You cannot mute a **Moderator, Administrator, or Servicer**.", color=0xFF0000)
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
         logger.info(f"{ctx.author} attempted to mute {member}, but they have a protected role.")
         return
 
     # Convert duration to seconds
-    time_multipliers = {"s": 1, "m": 60, "h": 3600, "d": 86400}
-    try:
-        unit = duration[-1]
-        if unit not in time_multipliers or not duration[:-1].isdigit():
-            raise ValueError
-        mute_seconds = int(duration[:-1]) * time_multipliers[unit]
-    except ValueError:
+    mute_seconds = parse_duration(duration)
+    if mute_seconds is None:
         embed = discord.Embed(title="❌ Invalid Duration Format", description="> Use a valid format: `Xs`, `Xm`, `Xh`, `Xd` (e.g., `10m` for 10 minutes)", color=0xFF0000)
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
         logger.info(f"{ctx.author} provided an invalid duration for 'mute' command.")
         return
 
-    # Apply timeout (mute) to the user
+    # Apply timeout (mute) to the user, and log it as a warning
     try:
-        until = discord.utils.utcnow() + datetime.timedelta(seconds=mute_seconds)
-        await member.edit(communication_disabled_until=until, reason=reason)
+        await apply_mute(member, mute_seconds, reason, duration, ctx.author)
     except discord.Forbidden:
         embed = discord.Embed(title="❌ Mute Failed", description="> I lack permission to mute this user.", color=0xFF0000)
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
         logger.error(f"Failed to mute {member} due to insufficient bot permissions.")
         return
 
-    # Log the mute as a warning
-    user_id = str(member.id)
-    warns = load_warns().get(user_id, [])
-
-    warns.append({
-        "warned_by": str(ctx.author),
-        "warned_by_id": ctx.author.id,
-        "reason": f"[MUTE] {reason} (Duration: {duration})",
-        "date": datetime.datetime.now(datetime.UTC).strftime("%Y-%m-%d %H:%M:%S")
-    })
-    save_warn(user_id, warns)
-
-    view = UnmuteButton(ctx.author.id, member)  # Unmute button
+    view = UnmuteButton(ctx.author.id, member.id)  # Unmute button
     done_view = DoneButton(ctx.author.id)  # Your existing Done button
     # Combine both views
-    combined_view = discord.ui.View()
+    combined_view = discord.ui.View(timeout=None)
     for child in view.children:
         combined_view.add_item(child)
     for child in done_view.children:
@@ -1652,30 +4576,84 @@ MODERATION_FOLDER = "moderation"
 BAN_LOG_FILE = os.path.join(MODERATION_FOLDER, "bans.json")
 os.makedirs(MODERATION_FOLDER, exist_ok=True)
 
-# Function to load bans
-def load_bans():
-    if not os.path.exists(BAN_LOG_FILE):
-        with open(BAN_LOG_FILE, "w") as file:
-            json.dump({}, file)
-    try:
-        with open(BAN_LOG_FILE, "r") as file:
-            return json.load(file)
-    except json.JSONDecodeError:
-        return {}
+BAN_JOURNAL_FILE = os.path.join(MODERATION_FOLDER, "bans_journal.jsonl")
+BAN_FUZZY_CANDIDATES = 500  # Most names /bans compares against when nothing starts with the query
+
+
+class BanRegistry(WriteBehindStore):
+    """
+    Ban records kept in memory, keyed by user ID, with a sorted name index so /bans can
+    look people up by exact or partial name without scanning every record.
+    """
+
+    def __init__(self, backend):
+        super().__init__(backend)
+        self.bans = backend.load()  # user ID (as a string) -> ban record, same layout as bans.json
+        self.names = sorted((data["user"].lower(), user_id) for user_id, data in self.bans.items())
+        self.by_name = {}  # Lowercase name -> user IDs with that name
+        for name, user_id in self.names:
+            self.by_name.setdefault(name, []).append(user_id)
+        self.order = list(self.bans)  # User IDs in the order they were banned
+
+    def get(self, user_id: str) -> dict | None:
+        return self.bans.get(user_id)
+
+    def add(self, user_id: str, record: dict):
+        previous = self.bans.get(user_id)
+        if previous is not None:
+            previous_name = previous["user"].lower()
+            del self.names[bisect.bisect_left(self.names, (previous_name, user_id))]
+            self.by_name[previous_name].remove(user_id)
+            if not self.by_name[previous_name]:
+                del self.by_name[previous_name]
+        else:
+            self.order.append(user_id)
 
-# Function to save bans
-def save_bans(ban_data):
-    with open(BAN_LOG_FILE, "w") as file:
-        json.dump(ban_data, file, indent=4)
+        self.bans[user_id] = record
+        bisect.insort(self.names, (record["user"].lower(), user_id))
+        self.by_name.setdefault(record["user"].lower(), []).append(user_id)
+        self.dirty.add(user_id)
+
+    def snapshot(self, key):
+        record = self.bans.get(key)
+        return dict(record) if record is not None else None
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        start = bisect.bisect_left(self.names, (prefix,))
+        end = bisect.bisect_left(self.names, (prefix + chr(0x10FFFF),), lo=start)
+        return start, end
+
+    def search(self, query: str, limit: int = 10) -> list[dict]:
+        # Exact ID, then exact name, then names starting with the query, then close spellings
+        record = self.bans.get(query)
+        if record is not None:
+            return [record]
+
+        query = query.lower()
+        exact = self.by_name.get(query)
+        if exact:
+            return [self.bans[user_id] for user_id in exact[:limit]]
+        start, end = self.prefix_range(query)
+        if start < end:
+            return [self.bans[user_id] for _, user_id in self.names[start:min(end, start + limit)]]
+
+        # Fuzzy matching only looks at a limited number of names sharing the first two letters, to keep it cheap
+        start, end = self.prefix_range(query[:2])
+        candidates = {name: user_id for name, user_id in self.names[start:min(end, start + BAN_FUZZY_CANDIDATES)]}
+        matches = difflib.get_close_matches(query, candidates, n=limit, cutoff=0.75)
+        return [self.bans[candidates[name]] for name in matches]
+
+
+ban_registry = BanRegistry(SQLiteTable(database, "bans") if database else JournaledJsonObjectFile(BAN_LOG_FILE, BAN_JOURNAL_FILE))
 
 # ======================================================================================================================================================================================
 # Ban Command
 
 @bot.slash_command(name="ban")
-async def ban(ctx: discord.ApplicationContext, member: Option(discord.Member, required=True, description="User to ban"), reason: Option(str, required=True, description="The reason for the ban")):
+async def ban(ctx: discord.ApplicationContext, member: Option(discord.Member, required=True, description="User to ban"), reason: Option(str, required=True, description="The reason for the ban"), duration: Option(str, required=False, description="How long to ban for, like 7d (leave empty to ban permanently)") = None):
 
     # Check if the user has the admin role
-    has_role = is_staff(ctx.author, False, True, True)
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1711,6 +4689,19 @@ async def ban(ctx: discord.ApplicationContext, member: Option(discord.Member, re
         logger.info(f"{ctx.author} attempted to ban {member} but did not provide a reason.")
         return
 
+    # Convert the duration to seconds, temporary bans are lifted by the timer scheduler
+    ban_seconds = parse_duration(duration) if duration else None
+    if duration and ban_seconds is None:
+        embed = discord.Embed(
+            title="❌ Invalid Duration Format",
+            description="> Use a valid format: `Xs`, `Xm`, `Xh`, `Xd` (e.g., `7d` for 7 days)",
+            color=colors["red"]
+        )
+        embed.set_footer(text="This message was written by server staff.")
+        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
+        logger.info(f"{ctx.author} provided an invalid duration for 'ban' command.")
+        return
+
     # Check if the member is bannable
     if not ctx.guild.me.guild_permissions.ban_members:
         embed = discord.Embed(
@@ -1739,27 +4730,30 @@ async def ban(ctx: discord.ApplicationContext, member: Option(discord.Member, re
     try:
         await member.ban(reason=reason)
 
-        # Log the ban in the JSON file
-        bans[str(member.id)] = {
+        # Log the ban in the ban registry
+        ban_registry.add(str(member.id), {
             "user": str(member.global_name),
             "user_id": member.id,
             "banned_by": str(ctx.author),
             "banned_by_id": ctx.author.id,
             "reason": reason,
             "date": str(datetime.datetime.now(datetime.UTC))
-        }
-        save_bans(bans)
+        })
+        if ban_seconds:
+            timer_store.schedule("unban", member.id, time.time() + ban_seconds, guild_id=ctx.guild.id)
+        else:
+            timer_store.cancel("unban", member.id)  # A permanent ban replaces any earlier temporary one
 
         # Send confirmation
         embed = discord.Embed(
             title="🔨 User Banned",
-            description=f"> **{member}** has been banned from the server.\n> **Reason:** {reason}",
+            description=f"> **{member}** has been banned from the server{f' for **{duration}**' if ban_seconds else ''}.\n> **Reason:** {reason}",
             color=colors["red"]
         )
         view = DoneButton(ctx.author.id)
         embed.set_footer(text=f"Banned by {ctx.author.display_name}")
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
-        logger.info(f"{ctx.author} banned {member} for: {reason}")
+        logger.info(f"{ctx.author} banned {member}{f' for {duration}' if ban_seconds else ''} for: {reason}")
 
     except discord.Forbidden:
         embed = discord.Embed(
@@ -1789,7 +4783,7 @@ async def restart(ctx: discord.ApplicationContext):
 
 
     # Check if the user has the "Administrator" or "Servicer" role
-    has_role = is_staff(ctx.author, False, True, True)
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1820,7 +4814,8 @@ async def restart(ctx: discord.ApplicationContext):
         # Gracefully close the bot
         await bot.close()
 
-        # Restart the bot
+        # Restart the bot (execl skips atexit, so write out the queued logs first)
+        log_listener.stop()
         python = sys.executable
         os.execl(python, python, *sys.argv)
 
@@ -1831,6 +4826,424 @@ async def restart(ctx: discord.ApplicationContext):
                               color=colors["red"])
         await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
 
+# ======================================================================================================================================================================================
+# Migrate JSON data to SQLite
+
+def migrate_json_to_sqlite() -> dict:
+    # Read every JSON store fresh from disk (journals included) and copy it over in one transaction
+    tickets = JsonObjectFile(MODMAIL_LOG_FILE).load()
+    afk_data = JsonObjectFile(AFK_FILE, indent=None).load()
+    ban_data = JournaledJsonObjectFile(BAN_LOG_FILE, BAN_JOURNAL_FILE).load()
+    warn_data = WarnJournal(WARN_FOLDER, WARN_JOURNAL_FILE).load()
+    timer_data = JournaledJsonObjectFile(TIMER_FILE, TIMER_JOURNAL_FILE, indent=None).load()
+
+    storage = SQLiteStorage(DATABASE_FILE)
+    warn_entries = [(user_id, warn) for user_id, user_warns in warn_data.items() for warn in user_warns]
+
+    storage.transaction(
+        [(f"DELETE FROM {table}", [()]) for table in ("tickets", "afk", "bans", "warns", "timers")]
+        + SQLiteTable(storage, "tickets").statements(tickets)
+        + SQLiteTable(storage, "afk").statements(afk_data)
+        + SQLiteTable(storage, "bans").statements(ban_data)
+        + SQLiteWarnLog(storage).statements(warn_entries)
+        + SQLiteTable(storage, "timers", key="key").statements(timer_data)
+    )
+    storage.connection.close()
+
+    return {"Tickets": len(tickets), "AFK Users": len(afk_data), "Bans": len(ban_data), "Warnings": len(warn_entries), "Timers": len(timer_data)}
+
+
+@bot.slash_command()
+async def migrate(ctx: discord.ApplicationContext):
+
+    # Check if the user has the "Administrator" or "Servicer" role
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
+    if not has_role:
+        embed = discord.Embed(
+            title="❌ Permission Denied",
+            description="> You need the `Administrator` role to use this command.",
+            color=colors["red"]
+        )
+        embed.set_footer(text="This message was written by server staff.")
+        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
+        logger.info(f"{ctx.author} attempted to use 'migrate' in {ctx.channel} but lacks permissions.")
+        return
+
+    # The live data already comes from the database, copying the old JSON files would overwrite it
+    if database is not None:
+        embed = discord.Embed(
+            title="⚠️ Already Using SQLite",
+            description="> The bot is already storing its data in SQLite.\n> \n> Set `STORAGE_BACKEND` to `json` to migrate again.",
+            color=colors["orange"]
+        )
+        embed.set_footer(text="This message was written by server staff.")
+        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
+        return
+
+    await ctx.defer()
+
+    # Make sure the JSON files have everything that's still waiting in memory
+    await flush_stores()
+
+    try:
+        counts = await asyncio.to_thread(migrate_json_to_sqlite)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Failed to migrate to SQLite: {e}")
+        embed = discord.Embed(
+            title="❌ Migration Failed",
+            description=f"> An error occurred while migrating the data.\n> \n> `{str(e)}`",
+            color=colors["red"]
+        )
+        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=10)
+        return
+
+    migrated = "\n".join([f"> **{name}:** {count}" for name, count in counts.items()])
+    embed = discord.Embed(
+        title="🗃️ Migration Complete",
+        description=f"{migrated}\n> \n> Set `STORAGE_BACKEND` to `sqlite` in `config.json` and use `/restart` to switch over.",
+        color=colors["green"]
+    )
+    embed.set_footer(text="This message was written by server staff.")
+    view = DoneButton(ctx.author.id)
+    await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
+    logger.info(f"{ctx.author} migrated the JSON data to SQLite: {counts}")
+
+# ======================================================================================================================================================================================
+# Event loop monitoring
+# A task wakes up every LOOP_LAG_INTERVAL seconds and records how late it was. A watchdog thread notices
+# when the loop stops waking up at all and logs what the loop thread is stuck on. Every event handler,
+# slash command and button callback is timed too. Ones that take longer than SLOW_CALLBACK_SECONDS are
+# logged with a stack: what they were running if they blocked the loop (sampled by the watchdog thread),
+# or else what they were waiting on. /lag shows a summary of the last few minutes.
+
+LOOP_LAG_INTERVAL = config.get("LOOP_LAG_INTERVAL", 0.5)  # Seconds between event loop lag measurements
+LOOP_STALL_SECONDS = config.get("LOOP_STALL_SECONDS", 0.25)  # Loop lag that gets logged with what's blocking it
+SLOW_CALLBACK_SECONDS = config.get("SLOW_CALLBACK_SECONDS", 1.0)  # Handlers, commands and buttons slower than this get logged
+LOOP_MONITOR_WINDOW = 600  # Seconds of lag measurements kept for /lag
+CALLBACK_SAMPLES = 256  # Recent timings kept per handler
+
+
+def coroutine_stack(task: asyncio.Task | None) -> str:
+    # Follows the chain of awaits, a suspended task on its own only shows its outermost frame
+    frames = []
+    coroutine = task.get_coro() if task is not None else None
+    while coroutine is not None:
+        frame = getattr(coroutine, "cr_frame", None) or getattr(coroutine, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coroutine = getattr(coroutine, "cr_await", None) or getattr(coroutine, "gi_yieldfrom", None)
+    return "".join(traceback.format_list(traceback.StackSummary.extract((frame, frame.f_lineno) for frame in frames)))
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class LoopMonitor:
+    """Measures event loop lag and how long handlers, commands and buttons take."""
+
+    def __init__(self, interval: float, stall_seconds: float, slow_seconds: float):
+        self.interval = interval
+        self.stall_seconds = stall_seconds
+        self.slow_seconds = slow_seconds
+        self.lags = collections.deque(maxlen=max(1, int(LOOP_MONITOR_WINDOW / interval)))
+        self.timings = {}  # Name -> recent durations
+        self.calls = collections.Counter()
+        self.slow_calls = collections.Counter()
+        self.stalls = 0
+        self.heartbeat = time.monotonic()
+        self.running = {}  # id -> timed callback still running: its task, start time and stack sample
+        self.loop = None
+        self.loop_thread_id = None
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.loop = asyncio.get_running_loop()
+            self.loop_thread_id = threading.get_ident()
+            self.heartbeat = time.monotonic()
+            self.task = asyncio.create_task(self.run())
+            threading.Thread(target=self.watchdog, name="loop-watchdog", daemon=True).start()
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.heartbeat = time.monotonic()
+            self.lags.append(self.heartbeat - started - self.interval)
+
+    def watchdog(self):
+        # Its own thread, so it can look at the loop thread while something is blocking it
+        reported = None
+        while True:
+            time.sleep(self.interval / 2)
+            heartbeat = self.heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.stall_seconds:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(not available)\n"
+            self.sample_blocking(stack)
+            if heartbeat != reported:
+                reported = heartbeat
+                self.stalls += 1
+                logger.warning(f"Event loop has been blocked for {stalled * 1000:.0f} ms, it's currently running:\n{stack}")
+
+    def sample_blocking(self, stack: str):
+        # Runs on the watchdog thread: a slow callback whose task is the one blocking the loop gets this stack
+        task = asyncio.current_task(self.loop)
+        now = time.perf_counter()
+        for call in list(self.running.values()):
+            if call["task"] is task and call["stack"] is None and now - call["started"] >= self.slow_seconds:
+                call["stack"] = f"After {(now - call['started']) * 1000:.0f} ms it was blocking the event loop, running:\n{stack}"
+
+    def sample_waiting(self, call: dict):
+        # Runs on the loop, so the callback isn't blocking it right now: this is what it's waiting on
+        if call["stack"] is None:
+            elapsed = time.perf_counter() - call["started"]
+            call["stack"] = f"After {elapsed * 1000:.0f} ms it was waiting at:\n{coroutine_stack(call['task'])}"
+
+    async def timed(self, name: str, awaitable):
+        call = {"task": asyncio.current_task(), "started": time.perf_counter(), "stack": None}
+        self.running[id(call)] = call
+        handle = asyncio.get_running_loop().call_later(self.slow_seconds, self.sample_waiting, call)
+        try:
+            return await awaitable
+        finally:
+            handle.cancel()
+            del self.running[id(call)]
+            self.record(name, time.perf_counter() - call["started"], call["stack"])
+
+    def record(self, name: str, duration: float, stack: str | None = None):
+        durations = self.timings.get(name)
+        if durations is None:
+            durations = self.timings[name] = collections.deque(maxlen=CALLBACK_SAMPLES)
+        durations.append(duration)
+        self.calls[name] += 1
+        metrics.observe(name, duration)
+
+        if duration >= self.slow_seconds:
+            self.slow_calls[name] += 1
+            logger.warning(f"Slow callback '{name}' took {duration * 1000:.0f} ms.{f' {stack}' if stack else ''}")
+
+    def wrap(self, name: str, callback):
+        @functools.wraps(callback)
+        async def wrapper(*args, **kwargs):
+            return await self.timed(name, callback(*args, **kwargs))
+        return wrapper
+
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_STALL_SECONDS, SLOW_CALLBACK_SECONDS)
+
+
+def instrument_event_handlers():
+    # Runs once every @bot.event handler is defined
+    for name, handler in list(vars(bot).items()):
+        if name.startswith("on_") and asyncio.iscoroutinefunction(handler) and not hasattr(handler, "__wrapped__"):
+            setattr(bot, name, loop_monitor.wrap(name, handler))
+
+
+# Slash commands
+invoke_application_command = bot.invoke_application_command
+
+
+async def timed_application_command(ctx: discord.ApplicationContext):
+    await loop_monitor.timed(f"/{ctx.command.qualified_name}", invoke_application_command(ctx))
+
+bot.invoke_application_command = timed_application_command
+
+# Button and select callbacks of every View
+view_scheduled_task = discord.ui.View._scheduled_task
+
+
+async def timed_view_callback(self, item, interaction):
+    callback = getattr(item.callback, "func", item.callback)
+    await loop_monitor.timed(f"{type(self).__name__}.{getattr(callback, '__name__', type(item).__name__)}", view_scheduled_task(self, item, interaction))
+
+discord.ui.View._scheduled_task = timed_view_callback
+
+
+@bot.slash_command()
+async def lag(ctx: discord.ApplicationContext):
+
+    # Check if the user has the "Administrator" or "Servicer" role
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
+    if not has_role:
+        embed = discord.Embed(
+            title="❌ Permission Denied",
+            description="> You need the `Administrator` role to use this command.",
+            color=colors["red"]
+        )
+        embed.set_footer(text="This message was written by server staff.")
+        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
+        logger.info(f"{ctx.author} attempted to use 'lag' in {ctx.channel} but lacks permissions.")
+        return
+
+    lags = list(loop_monitor.lags)
+    loop_summary = (
+        f"> **Average:** `{sum(lags) / len(lags) * 1000 if lags else 0:.1f}ms`\n"
+        f"> **95th Percentile:** `{percentile(lags, 0.95) * 1000:.1f}ms`\n"
+        f"> **Worst:** `{max(lags, default=0) * 1000:.1f}ms`\n"
+        f"> **Blocked:** {loop_monitor.stalls} times"
+    )
+
+    # The slowest callbacks by their 95th percentile over their recent calls
+    slowest = sorted(loop_monitor.timings.items(), key=lambda item: percentile(item[1], 0.95), reverse=True)[:10]
+    callback_summary = "\n".join(
+        f"> `{name}` → p95 `{percentile(durations, 0.95) * 1000:.0f}ms`, worst `{max(durations) * 1000:.0f}ms`, "
+        f"{loop_monitor.calls[name]} calls, {loop_monitor.slow_calls[name]} slow"
+        for name, durations in slowest
+    )
+
+    embed = discord.Embed(title="🐢 Event Loop Lag", color=colors["blue"])
+    embed.add_field(name=f"Loop Lag (last {len(lags) * LOOP_LAG_INTERVAL / 60:.0f} minutes)", value=loop_summary, inline=False)
+    embed.add_field(name="Slowest Callbacks", value=callback_summary[:1024] or "> Nothing timed yet.", inline=False)
+    embed.set_footer(text=f"Callbacks slower than {SLOW_CALLBACK_SECONDS * 1000:.0f}ms are logged with a stack sample.")
+    view = DoneButton(ctx.author.id)
+    await ctx.respond(f"### {ctx.author.mention}", embed=embed, view=view)
+    logger.info(f"{ctx.author} checked the event loop lag in {ctx.channel}.")
+
+# ======================================================================================================================================================================================
+# Metrics
+# Serves the bot's counters in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics.
+# Every timing the loop monitor records also goes into a histogram here. Everything is only touched
+# from the event loop, so plain counters are enough and no locks are needed.
+
+METRICS_PORT = config.get("METRICS_PORT", 0)  # Port for the /metrics endpoint, 0 turns it off
+METRICS_HOST = config.get("METRICS_HOST", "127.0.0.1")  # Address the /metrics endpoint listens on
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # Histogram bucket bounds in seconds
+
+
+class Histogram:
+    """Counts observations into fixed buckets, like a Prometheus histogram."""
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def metric_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+LABEL_ESCAPES = str.maketrans({"\\": "\\\\", '"': '\\"', "\n": "\\n"})
+
+
+def metric_labels(**labels) -> str:
+    return "{" + ",".join(f'{key}="{str(value).translate(LABEL_ESCAPES)}"' for key, value in labels.items()) + "}"
+
+
+class Metrics:
+    """Collects the bot's metrics and serves them over HTTP."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.histograms = {}  # (kind, name) -> Histogram
+        self.rest_requests = collections.Counter()  # (method, route) -> requests
+        self.runner = None
+
+    def observe(self, name: str, duration: float):
+        # The loop monitor names event handlers "on_...", slash commands "/..." and the rest are View callbacks
+        kind = "event" if name.startswith("on_") else "command" if name.startswith("/") else "component"
+        histogram = self.histograms.get((kind, name))
+        if histogram is None:
+            histogram = self.histograms[(kind, name)] = Histogram(LATENCY_BUCKETS)
+        histogram.observe(duration)
+
+    async def start(self):
+        if self.runner is not None or not self.port:
+            return
+
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f"Couldn't start the metrics endpoint on {self.host}:{self.port}: {e}")
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help_text: str):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for kind, help_text in (
+            ("event", "Time spent in gateway event handlers."),
+            ("command", "Time spent in slash commands."),
+            ("component", "Time spent in button and select callbacks."),
+        ):
+            name = f"phantom_{kind}_duration_seconds"
+            family(name, "histogram", help_text)
+            for (histogram_kind, label), histogram in sorted(self.histograms.items()):
+                if histogram_kind != kind:
+                    continue
+                cumulative = 0
+                for bound, count in zip([*map(metric_value, histogram.bounds), "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{metric_labels(handler=label, le=bound)} {cumulative}")
+                lines.append(f"{name}_sum{metric_labels(handler=label)} {metric_value(histogram.sum)}")
+                lines.append(f"{name}_count{metric_labels(handler=label)} {histogram.count}")
+
+        family("phantom_rest_requests_total", "counter", 'REST requests sent to Discord by route. Webhooks, interaction responses and CDN downloads skip the dispatcher and are counted as route="other".')
+        for (method, route), count in sorted(self.rest_requests.items()):
+            lines.append(f"phantom_rest_requests_total{metric_labels(method=method, route=route)} {count}")
+
+        for name, kind, help_text, value in (
+            ("phantom_rest_rate_limits_total", "counter", "429 responses received from Discord.", outbound.rate_limits),
+            ("phantom_rest_shed_total", "counter", "Low priority requests put off while rate limited.", outbound.shed),
+            ("phantom_log_queue_depth", "gauge", "Log embeds waiting to be sent.", len(log_sink.queue)),
+            ("phantom_log_dropped_total", "counter", "Log embeds dropped because the queue was full.", log_sink.dropped_total),
+            ("phantom_log_messages_sent_total", "counter", "Messages sent to the text log channel.", log_sink.sent_messages),
+            ("phantom_log_embeds_sent_total", "counter", "Log embeds sent to the text log channel.", log_sink.sent_embeds),
+            ("phantom_log_records_queued", "gauge", "Log records waiting for the log file and console writer thread.", log_queue.qsize()),
+            ("phantom_image_archived_bytes_total", "counter", "Bytes of new images written to the image store.", image_archiver.archived_bytes),
+            ("phantom_image_queue_depth", "gauge", "Messages waiting for their images to be archived.", image_archiver.queue.qsize()),
+            ("phantom_image_dropped_total", "counter", "Messages whose images were skipped because the queue was full.", image_archiver.dropped),
+            ("phantom_welcome_dms_skipped_total", "counter", "Welcome DMs skipped because the queue was full.", welcome_batcher.skipped_dms),
+            ("phantom_spam_caught_total", "counter", "Members caught by the spam detector.", spam_detector.caught),
+            ("phantom_raids_total", "counter", "Raids detected.", raid_detector.raids),
+            ("phantom_modmail_open_tickets", "gauge", "Modmail tickets currently open.", len(modmail_store.open_by_user)),
+            ("phantom_event_loop_lag_seconds", "gauge", "Most recent event loop lag measurement.", loop_monitor.lags[-1] if loop_monitor.lags else 0.0),
+            ("phantom_gateway_latency_seconds", "gauge", "Gateway heartbeat latency.", bot.latency),
+        ):
+            family(name, kind, help_text)
+            lines.append(f"{name} {metric_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics(METRICS_HOST, METRICS_PORT)
+
 # ======================================================================================================================================================================================
 # Ping Command
 
@@ -1839,7 +5252,7 @@ async def ping(ctx: discord.ApplicationContext):
 
 
     # Check if the user has the required role (Administrator or Servicer)
-    has_role = any(role.id in ADMIN_ROLE_ID or role.id in SERVICER_ROLE_ID for role in ctx.author.roles)
+    has_role = has_staff_level(ctx.author, ADMIN_LEVEL)
     if not has_role:
         embed = discord.Embed(
             title="❌ Permission Denied",
@@ -1852,21 +5265,9 @@ async def ping(ctx: discord.ApplicationContext):
         return  # Exit early before applying cooldown
 
     # Apply cooldown only if user has the proper role
-    if ctx.command.is_on_cooldown(ctx):
-        retry_after = ctx.command.get_cooldown_retry_after(ctx)
-        embed = discord.Embed(
-            title="⏳ Cooldown!",
-            description=f"> This command is on cooldown! Try again in `{retry_after:.2f}` seconds.",
-            color=colors["red"]
-        )
-        embed.set_footer(text="This message was written by server staff.")
-        await ctx.respond(f"### {ctx.author.mention}", embed=embed, delete_after=5)
-        logger.info(f"{ctx.author} tried 'ping' in {ctx.channel}, but it's on cooldown.")
+    if await on_cooldown(ctx, ping_limiter, ctx.author.id):
         return
 
-    # Apply cooldown manually after permission check
-    ctx.command.reset_cooldown(ctx)
-
     # Get bot latency
     latency = round(bot.latency * 1000)  # Convert to milliseconds
 
@@ -1886,10 +5287,9 @@ async def ping(ctx: discord.ApplicationContext):
 # ======================================================================================================================================================================================
 # Run the bot
 
-if __name__ == "__main__":
-    # Load bans
-    bans = load_bans()
+instrument_event_handlers()
 
+if __name__ == "__main__":
     bot.run(BOT_TOKEN)
 
 # Saucywan was here.